@@ -26,5 +26,47 @@ class Settings(BaseSettings):
     db_pool_recycle: int = 3600
     db_echo: bool = False
 
+    # Task Processing Configuration
+    process_files_async: bool = os.getenv("PROCESS_FILES_ASYNC", "false").lower() == "true"
+    task_workers: int = int(os.getenv("TASK_WORKERS", 4))
+    task_lease_seconds: int = int(os.getenv("TASK_LEASE_SECONDS", 300))
+    task_poll_interval: float = float(os.getenv("TASK_POLL_INTERVAL", 5))
+    task_max_attempts: int = int(os.getenv("TASK_MAX_ATTEMPTS", 3))
+    task_progress_persist_interval: float = float(os.getenv("TASK_PROGRESS_PERSIST_INTERVAL", 2))
+    task_status_poll_interval: float = float(os.getenv("TASK_STATUS_POLL_INTERVAL", 5))
+    task_status_stream_timeout: float = float(os.getenv("TASK_STATUS_STREAM_TIMEOUT", 600))
+
+    # Storage Configuration
+    storage_backend: str = os.getenv("STORAGE_BACKEND", "gcs")
+    local_storage_root: str = os.getenv("LOCAL_STORAGE_ROOT", "storage")
+    storage_pool_size: int = int(os.getenv("STORAGE_POOL_SIZE", 32))
+    finishing_workers: int = int(os.getenv("FINISHING_WORKERS", 8))
+    download_spool_max_size: int = int(os.getenv("DOWNLOAD_SPOOL_MAX_SIZE", 16 * 1024 * 1024))
+    signed_url_expiration_minutes: int = int(os.getenv("SIGNED_URL_EXPIRATION_MINUTES", 10))
+    signed_url_cache_seconds: int = int(os.getenv("SIGNED_URL_CACHE_SECONDS", 300))
+    dataset_count_cache_seconds: int = int(os.getenv("DATASET_COUNT_CACHE_SECONDS", 300))
+
+    # Excel Processing Configuration
+    # "full" loads every sheet with styles; "lazy" only keeps the annotated
+    # sheets editable and reads reference sheets values-only on demand, their
+    # formatting is then not carried over to the processed output; annotated
+    # sheets are streamed with the sheet properties listed in LazyWorkbook
+    excel_load_mode: str = os.getenv("EXCEL_LOAD_MODE", "full")
+    # Reader of the reference sheets in lazy mode: "openpyxl" or "fast", the
+    # latter parses the sheet XML directly, with formulas read as their
+    # cached values, in up to EXCEL_READER_PROCESSES worker processes
+    excel_reader_engine: str = os.getenv("EXCEL_READER_ENGINE", "openpyxl")
+    excel_reader_processes: int = int(os.getenv("EXCEL_READER_PROCESSES", 1))
+    # "rules" checks every Manual Sheet rule in a single pass over the rows,
+    # "vectorized" checks whole columns with pandas and only visits the cells
+    # to annotate, "rowwise" runs one pass per validation
+    validation_engine: str = os.getenv("VALIDATION_ENGINE", "rules")
+    # Row-level error report written next to the JSON summary: "ndjson",
+    # "csv", or empty for none
+    validation_error_report_format: str = os.getenv("VALIDATION_ERROR_REPORT_FORMAT", "")
+    # Whether the annotated workbook is written as the processed output, it
+    # is generated when the outputs are uploaded, after the DB stage
+    validation_output_workbook: bool = os.getenv("VALIDATION_OUTPUT_WORKBOOK", "true").lower() == "true"
+
 
 settings = Settings()
\ No newline at end of file
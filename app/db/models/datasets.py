@@ -1,9 +1,10 @@
-from sqlalchemy import Column, String, Text, Integer, DateTime, ForeignKey
+from sqlalchemy import Column, String, Text, Integer, DateTime, ForeignKey, Index, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from app.db.base_class import Base
 from app.core.config import settings
+from app.utils.helpers import TTLCache
 
 
 class Datasets(Base):
@@ -23,8 +24,18 @@ class Datasets(Base):
 
 
 class DatasetObjects(Base):
+    __table_args__ = (
+        # Serves `bucket_name = ... AND object_path LIKE 'prefix%'` lookups
+        Index(
+            f"ix_{settings.db_table_prefix}_dataset_objects_bucket_object_path",
+            "bucket_name",
+            "object_path",
+            postgresql_ops={"object_path": "text_pattern_ops"},
+        ),
+    )
+
     id = Column(Integer, primary_key=True, autoincrement=True)
-    dataset_id = Column(String(50), ForeignKey(f"{settings.db_table_prefix}_datasets.dataset_id"), nullable=False)
+    dataset_id = Column(String(50), ForeignKey(f"{settings.db_table_prefix}_datasets.dataset_id"), nullable=False, index=True)
     file_type = Column(String(50), nullable=False)
     bucket_name = Column(String(100), nullable=False)
     object_path = Column(Text, nullable=False)
@@ -35,6 +46,22 @@ class DatasetObjects(Base):
     )
 
 
+# Number of datasets per (bucket, prefix, category) listed by the catalog.
+# Cleared whenever datasets or their objects are written by this process,
+# the TTL bounds staleness from writes made elsewhere.
+dataset_count_cache = TTLCache(ttl=settings.dataset_count_cache_seconds)
+
+
+@event.listens_for(Datasets, "after_insert")
+@event.listens_for(Datasets, "after_update")
+@event.listens_for(Datasets, "after_delete")
+@event.listens_for(DatasetObjects, "after_insert")
+@event.listens_for(DatasetObjects, "after_update")
+@event.listens_for(DatasetObjects, "after_delete")
+def invalidate_dataset_counts(mapper, connection, target):
+    dataset_count_cache.clear()
+
+
 # Example Insertion
 """
 new_dataset = Dataset(
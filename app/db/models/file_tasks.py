@@ -1,6 +1,7 @@
-from sqlalchemy import Column, String, Integer, DateTime, JSON, Enum
+from sqlalchemy import Boolean, Column, String, Integer, DateTime, JSON, Enum, Index, false
 from sqlalchemy.ext.declarative import declarative_base
 from app.db.base_class import Base
+from app.core.config import settings
 import datetime
 from enum import Enum as PyEnum
 
@@ -17,15 +18,39 @@ class ProcessingStatus(str, PyEnum):
 
 
 class FileTasks(Base):
+    __table_args__ = (
+        # Task listing by status/bucket and the work queue, newest or oldest first
+        Index(f"ix_{settings.db_table_prefix}_file_tasks_status_created_at", "status", "created_at", "id"),
+        Index(f"ix_{settings.db_table_prefix}_file_tasks_bucket_created_at", "bucket", "created_at", "id"),
+        Index(f"ix_{settings.db_table_prefix}_file_tasks_created_at", "created_at", "id"),
+    )
+
     id = Column(Integer, primary_key=True, index=True)
     file_id = Column(String, unique=True, nullable=False)
-    file_path = Column(String, nullable=False)
+    file_path = Column(String, nullable=False, index=True)
     bucket = Column(String, nullable=False)
     processors = Column(JSON, nullable=False)
     processed_output_path = Column(String, nullable=True)
+    validation_report_path = Column(String, nullable=True)
+    # Row-level validation errors, NDJSON or CSV
+    error_report_path = Column(String, nullable=True)
+    content_sha256 = Column(String(64), nullable=True, index=True)
+    # file_id of the earlier task whose results were reused for identical content
+    deduplicated_from = Column(String, nullable=True)
+    # Whether later uploads of the same content may reuse the outputs, False
+    # when a stage such as the database load failed
+    results_reusable = Column(Boolean, nullable=False, default=False, server_default=false())
     status = Column(
         Enum(ProcessingStatus), nullable=False, default=ProcessingStatus.PENDING
     )
+    # Last reported stage, e.g. {"stage": "transactions", "current": 10, "total": 40}
+    progress = Column(JSON, nullable=True)
+
+    # Work queue lease, see app.task_management.scheduler.FileTaskQueue
+    lease_owner = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
 
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     updated_at = Column(
@@ -0,0 +1,218 @@
+"""
+Schema upgrade of the FileTasks and DatasetObjects tables, run as a deploy step.
+
+Adds the columns and indexes of the work queue, progress reporting,
+deduplication and validation report features to a FileTasks table created
+before them, and the indexes of the dataset catalog to DatasetObjects. Run it once before rolling out a version that depends on them; it is
+idempotent, so it can be run again after a failure:
+
+    python -m app.db.upgrade           # apply the upgrade
+    python -m app.db.upgrade --sql     # print the statements instead
+
+The columns are added in one short transaction that gives up after
+LOCK_TIMEOUT instead of queueing every task query behind its lock; rerun the
+upgrade when it does. Columns with a constant default do not rewrite the
+table. The indexes are then built with CREATE INDEX CONCURRENTLY outside of
+any transaction, so the table stays readable and writable meanwhile; an
+index left invalid by an interrupted build is dropped and built again.
+
+Tasks still PENDING when the lease columns are added were created by the
+previous version, which processes each file in the request that created its
+task. They are leased to LEGACY_LEASE_OWNER for --legacy-grace-seconds with
+their attempts used up, so queue workers never process them again: those the
+previous version finishes keep their status, the others are marked FAILED by
+the queue once the grace period ends. Tasks the previous version creates
+while the rollout is in progress can be covered by running the upgrade again
+with --legacy-before set to the time the rollout finished.
+"""
+import argparse
+import re
+from datetime import datetime, timedelta
+from typing import List, Optional
+from sqlalchemy import Engine, Index, func, text, update
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.sql.dml import Update
+from app.core.config import settings
+from app.db.models.datasets import DatasetObjects
+from app.db.models.file_tasks import FileTasks, ProcessingStatus
+from app.utils.logger import logger
+
+# Columns added to FileTasks after its first release, in order
+FILE_TASKS_ADDED_COLUMNS = [
+    "validation_report_path",
+    "error_report_path",
+    "content_sha256",
+    "deduplicated_from",
+    "results_reusable",
+    "progress",
+    "lease_owner",
+    "lease_expires_at",
+    "heartbeat_at",
+    "attempts",
+]
+
+# Longest wait for the table lock of the ALTER TABLE
+LOCK_TIMEOUT = "5s"
+# Lease owner of the tasks left PENDING by the previous version
+LEGACY_LEASE_OWNER = "schema-upgrade"
+# Default time the previous version has to finish its PENDING tasks
+LEGACY_GRACE_SECONDS = 3600
+
+
+def add_columns_statement() -> str:
+    """ALTER TABLE adding the missing FileTasks columns, under a single lock."""
+    dialect = postgresql.dialect()
+    table = FileTasks.__table__
+    clauses = []
+    for name in FILE_TASKS_ADDED_COLUMNS:
+        column = table.c[name]
+        clause = f"ADD COLUMN IF NOT EXISTS {name} {column.type.compile(dialect=dialect)}"
+        if column.server_default is not None:
+            default = column.server_default.arg
+            if not isinstance(default, str):
+                default = default.compile(dialect=dialect)
+            clause += f" DEFAULT {default}"
+        if not column.nullable:
+            clause += " NOT NULL"
+        clauses.append(clause)
+    return f"ALTER TABLE {table.fullname} " + ", ".join(clauses)
+
+
+def legacy_pending_statement(grace_seconds: int, created_before: Optional[datetime] = None) -> Update:
+    """
+    UPDATE keeping the queue away from the PENDING tasks of the previous version.
+
+    Args:
+        grace_seconds (int): Time the previous version has to finish them.
+        created_before (datetime, optional): Only tasks created before this
+            UTC time. Defaults to all the tasks without a lease.
+
+    Returns:
+        Update: The statement.
+    """
+    stmt = (
+        update(FileTasks)
+        .where(FileTasks.status == ProcessingStatus.PENDING, FileTasks.lease_owner.is_(None))
+        .values(
+            lease_owner=LEGACY_LEASE_OWNER,
+            lease_expires_at=func.timezone("utc", func.now()) + timedelta(seconds=grace_seconds),
+            attempts=settings.task_max_attempts,
+            updated_at=func.timezone("utc", func.now()),
+        )
+    )
+    if created_before is not None:
+        stmt = stmt.where(FileTasks.created_at < created_before)
+    return stmt
+
+
+def upgrade_indexes() -> List[Index]:
+    """Indexes declared on the models that older databases may lack."""
+    return [
+        *sorted(FileTasks.__table__.indexes, key=lambda index: index.name),
+        *sorted(DatasetObjects.__table__.indexes, key=lambda index: index.name),
+    ]
+
+
+def qualified_name(index: Index) -> str:
+    schema = index.table.schema
+    return f"{schema}.{index.name}" if schema else index.name
+
+
+def create_index_statement(index: Index) -> str:
+    """CREATE INDEX CONCURRENTLY IF NOT EXISTS of an index."""
+    statement = str(CreateIndex(index, if_not_exists=True).compile(dialect=postgresql.dialect()))
+    return re.sub(r"^CREATE (UNIQUE )?INDEX", r"CREATE \1INDEX CONCURRENTLY", statement)
+
+
+def upgrade_statements(legacy_grace_seconds: int = LEGACY_GRACE_SECONDS) -> List[str]:
+    """
+    Statements of the upgrade, as run on a table without the lease columns.
+
+    Returns:
+        list: SQL statements for PostgreSQL.
+    """
+    legacy = legacy_pending_statement(legacy_grace_seconds).compile(
+        dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}
+    )
+    return [
+        "BEGIN",
+        f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'",
+        add_columns_statement(),
+        str(legacy),
+        "COMMIT",
+        *[create_index_statement(index) for index in upgrade_indexes()],
+    ]
+
+
+def upgrade_schema(
+    engine: Engine,
+    legacy_grace_seconds: int = LEGACY_GRACE_SECONDS,
+    legacy_before: Optional[datetime] = None,
+):
+    """
+    Apply the upgrade.
+
+    Args:
+        engine: Engine of the database.
+        legacy_grace_seconds (int): Time the previous version has to finish
+            its PENDING tasks.
+        legacy_before (datetime, optional): Also lease the PENDING tasks
+            without a lease created before this UTC time when the lease
+            columns already exist.
+    """
+    table = FileTasks.__table__
+    with engine.begin() as connection:
+        connection.execute(text(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'"))
+        has_leases = connection.execute(
+            text(
+                "SELECT 1 FROM information_schema.columns "
+                "WHERE table_schema = :schema AND table_name = :table AND column_name = 'lease_owner'"
+            ),
+            {"schema": table.schema or "public", "table": table.name},
+        ).first() is not None
+        connection.execute(text(add_columns_statement()))
+        if not has_leases or legacy_before is not None:
+            leased = connection.execute(legacy_pending_statement(legacy_grace_seconds, legacy_before)).rowcount
+            logger.info(f"{leased} PENDING tasks of the previous version leased to {LEGACY_LEASE_OWNER}")
+    logger.info(f"Columns of {table.fullname} are up to date")
+
+    # CONCURRENTLY cannot run inside a transaction
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        for index in upgrade_indexes():
+            name = qualified_name(index)
+            invalid = connection.execute(
+                text("SELECT 1 FROM pg_index WHERE indexrelid = to_regclass(:name) AND NOT indisvalid"),
+                {"name": name},
+            ).first()
+            if invalid:
+                logger.warning(f"Index {name} is invalid, building it again")
+                connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+            connection.execute(text(create_index_statement(index)))
+            logger.info(f"Index {name} is up to date")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sql", action="store_true", help="Print the statements instead of applying them")
+    parser.add_argument(
+        "--legacy-grace-seconds", type=int, default=LEGACY_GRACE_SECONDS,
+        help="Time the previous version has to finish its PENDING tasks",
+    )
+    parser.add_argument(
+        "--legacy-before", type=datetime.fromisoformat,
+        help="Also keep the queue away from unleased PENDING tasks created before this UTC time",
+    )
+    args = parser.parse_args()
+
+    if args.sql:
+        for statement in upgrade_statements(args.legacy_grace_seconds):
+            print(f"{statement};")
+        return
+
+    from app.db.session import DatabaseManager
+    upgrade_schema(DatabaseManager.get_engine(), args.legacy_grace_seconds, args.legacy_before)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+from typing import Dict, List, Tuple
+from openpyxl.cell import Cell
+from openpyxl.comments import Comment
+from openpyxl.styles import Alignment, PatternFill
+
+COMMENT_AUTHOR = "COSA Validation System"
+COMMENT_SEPARATOR = ", "
+
+# Style objects shared by every annotated cell
+NO_FILL = PatternFill()
+LEFT_ALIGNMENT = Alignment(horizontal="left")
+_solid_fills: Dict[str, PatternFill] = {}
+
+
+def solid_fill(color: str) -> PatternFill:
+    """Shared solid PatternFill of a color"""
+    if color not in _solid_fills:
+        _solid_fills[color] = PatternFill(start_color=color, end_color=color, fill_type="solid")
+    return _solid_fills[color]
+
+
+def styled_rows(ws, column: int, min_row: int) -> List[int]:
+    """
+    Rows of a column, from min_row, whose cell has a comment or a fill.
+
+    These are the only cells of an openpyxl worksheet that clearing a
+    message can change; the cells are not created when missing.
+    """
+    return sorted(
+        row
+        for (row, col), cell in ws._cells.items()
+        if col == column and row >= min_row
+        and (cell.comment is not None or (cell.has_style and cell.fill.fill_type is not None))
+    )
+
+
+def unique_messages(messages: List[str]) -> List[str]:
+    """Messages without duplicates, in order of first appearance"""
+    return list(dict.fromkeys(messages))
+
+
+class CellAnnotations:
+    """
+    Mark and clear operations on cells, collected during validation and applied in one batch.
+
+    Operations on a cell are replayed in order when applied, with the same
+    outcome as marking and clearing the cell immediately, but each cell
+    gets its final fill and at most one new Comment.
+    """
+
+    def __init__(self, color: str = "FF0000"):
+        self.fill = solid_fill(color)
+        # (row, column) -> cell and its ("mark" | "clear", message) operations
+        self._cells: Dict[Tuple[int, int], Tuple[Cell, List[Tuple[str, str]]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._cells)
+
+    def mark(self, cell: Cell, message: str):
+        """Fill the cell and add the message to its comment"""
+        self._cells.setdefault((cell.row, cell.column), (cell, []))[1].append(("mark", message))
+
+    def clear(self, cell: Cell, message: str):
+        """Remove the message from the comment of the cell, and its fill when no message is left"""
+        key = (cell.row, cell.column)
+        # Nothing to clear on a cell without comment, fill or pending operation
+        if key in self._cells or cell.comment is not None or cell.fill.fill_type is not None:
+            self._cells.setdefault(key, (cell, []))[1].append(("clear", message))
+
+    def apply(self) -> int:
+        """
+        Apply the collected operations to their cells.
+
+        Returns:
+            int: Number of cells updated
+        """
+        for cell, operations in self._cells.values():
+            messages = cell.comment.text.split(COMMENT_SEPARATOR) if cell.comment is not None else None
+            fill = None
+            for operation, message in operations:
+                if operation == "mark":
+                    messages = unique_messages((messages or []) + [message])
+                    fill = self.fill
+                elif messages is not None:
+                    messages = [text for text in messages if text != message] or None
+                    if messages is None:
+                        fill = NO_FILL
+                else:
+                    fill = NO_FILL
+
+            if messages is not None:
+                cell.comment = Comment(text=COMMENT_SEPARATOR.join(unique_messages(messages)), author=COMMENT_AUTHOR)
+            elif cell.comment is not None:
+                cell.comment = None
+            if fill is not None:
+                cell.fill = fill
+
+        updated = len(self._cells)
+        self._cells.clear()
+        return updated
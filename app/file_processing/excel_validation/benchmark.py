@@ -0,0 +1,91 @@
+"""
+Benchmark of the xlsx reader engines on a generated workbook.
+
+Usage:
+    python -m app.file_processing.excel_validation.benchmark --rows 100000 --sheets 4 --processes 4
+"""
+import argparse
+import io
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Callable, List
+from openpyxl import Workbook, load_workbook
+from app.file_processing.excel_validation.fast_reader import read_sheets
+
+COLUMNS = ["Company Name", "Container #", "Country", "Volume", "Price", "Shipment Date"]
+
+
+def generate_workbook(rows: int, sheets: int) -> io.BytesIO:
+    """Generate an xlsx file with `sheets` reference-like sheets of `rows` rows."""
+    wb = Workbook(write_only=True)
+    start = datetime(2024, 1, 1)
+    for sheet_idx in range(sheets):
+        ws = wb.create_sheet(f"Sheet {sheet_idx + 1}")
+        ws.append(COLUMNS)
+        for row_idx in range(rows):
+            ws.append([
+                f"Company {random.randint(1, rows // 10 + 1)}",
+                f"MSKU {row_idx:07d}",
+                random.choice(["Brazil", "Colombia", "Peru", "Kenya", "Vietnam"]),
+                random.randint(1, 20000),
+                round(random.uniform(1, 10), 4),
+                start + timedelta(days=row_idx % 365),
+            ])
+    output = io.BytesIO()
+    wb.save(output)
+    output.seek(0)
+    return output
+
+
+def read_openpyxl_full(file_content: io.BytesIO) -> List[str]:
+    wb = load_workbook(file_content)
+    for ws in wb.worksheets:
+        for _ in ws.iter_rows(values_only=True):
+            pass
+    return wb.sheetnames
+
+
+def read_openpyxl_read_only(file_content: io.BytesIO) -> List[str]:
+    wb = load_workbook(file_content, read_only=True)
+    for ws in wb.worksheets:
+        for _ in ws.iter_rows(values_only=True):
+            pass
+    wb.close()
+    return wb.sheetnames
+
+
+def measure(name: str, function: Callable[[io.BytesIO], object], file_content: io.BytesIO):
+    file_content.seek(0)
+    started = time.perf_counter()
+    function(file_content)
+    print(f"{name:<32} {time.perf_counter() - started:8.2f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=50000, help="Rows per sheet")
+    parser.add_argument("--sheets", type=int, default=4, help="Number of sheets")
+    parser.add_argument("--processes", type=int, default=4, help="Processes of the parallel fast reader")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    file_content = generate_workbook(args.rows, args.sheets)
+    size = len(file_content.getvalue()) / (1024 * 1024)
+    print(
+        f"Generated {args.sheets} sheets x {args.rows} rows ({size:.1f} MB) "
+        f"in {time.perf_counter() - started:.2f} s"
+    )
+
+    measure("openpyxl (full)", read_openpyxl_full, file_content)
+    measure("openpyxl (read-only)", read_openpyxl_read_only, file_content)
+    measure("fast reader", read_sheets, file_content)
+    measure(
+        f"fast reader ({args.processes} processes)",
+        lambda content: read_sheets(content, processes=args.processes),
+        file_content,
+    )
+
+
+if __name__ == "__main__":
+    main()
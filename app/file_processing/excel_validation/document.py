@@ -0,0 +1,81 @@
+import threading
+from typing import BinaryIO, Dict, List, Optional
+from openpyxl import Workbook, load_workbook
+from app.core.config import settings
+from app.file_processing.excel_validation.lazy_workbook import LazyWorkbook
+from app.file_processing.excel_validation.loader import (
+    MOTHER_PARKERS_WRITABLE_SHEETS, read_sheet_names
+)
+from app.utils.helpers import file_sha256
+from app.utils.logger import logger
+
+
+class ParsedDocument:
+    """
+    Parsed forms of one uploaded workbook, shared by every stage reading it.
+
+    Each form is built on first access and kept, so detection, validation
+    and the database load parse the file at most once.
+    """
+
+    def __init__(self, file_content: BinaryIO, content_sha256: Optional[str] = None):
+        self.file = file_content
+        self.content_sha256 = content_sha256
+        self._sheet_names: Optional[List[str]] = None
+        self._workbook: Optional[Workbook] = None
+        self._lock = threading.Lock()
+
+    @property
+    def sheet_names(self) -> List[str]:
+        """Sheet names, read from the zip container without parsing the sheets."""
+        if self._sheet_names is None:
+            self._sheet_names = read_sheet_names(self.file)
+        return self._sheet_names
+
+    @property
+    def workbook(self) -> Workbook:
+        """
+        Workbook parsed on first access, according to the EXCEL_LOAD_MODE setting.
+
+        "full" loads every sheet into an editable openpyxl Workbook. "lazy"
+        returns a LazyWorkbook where only the annotated sheets are editable
+        and the reference sheets are read values-only when first accessed.
+        """
+        with self._lock:
+            if self._workbook is None:
+                logger.info(f"Parsing workbook {self.content_sha256} ({settings.excel_load_mode} mode)")
+                self.file.seek(0)
+                if settings.excel_load_mode == "lazy":
+                    self._workbook = LazyWorkbook(self.file, MOTHER_PARKERS_WRITABLE_SHEETS)
+                else:
+                    self._workbook = load_workbook(self.file)
+                self._sheet_names = self._workbook.sheetnames
+            return self._workbook
+
+
+class DocumentContext:
+    """Parsed documents of one request, keyed by content hash."""
+
+    def __init__(self):
+        self._documents: Dict[str, ParsedDocument] = {}
+
+    def get(self, file_content: BinaryIO, content_sha256: Optional[str] = None) -> ParsedDocument:
+        """
+        Get the parsed document of a file, creating it on first use.
+
+        Args:
+            file_content: Seekable binary file.
+            content_sha256: SHA-256 hex digest of the file, computed if missing.
+
+        Returns:
+            ParsedDocument: The document shared by every caller with the same content.
+        """
+        if content_sha256 is None:
+            content_sha256 = file_sha256(file_content)
+        if content_sha256 not in self._documents:
+            self._documents[content_sha256] = ParsedDocument(file_content, content_sha256)
+        return self._documents[content_sha256]
+
+    def clear(self):
+        """Drop the parsed documents so their memory can be released."""
+        self._documents.clear()
@@ -0,0 +1,73 @@
+import csv
+import io
+import json
+import tempfile
+from typing import Any, BinaryIO, Dict, List
+from app.core.config import settings
+
+ERROR_REPORT_FIELDS = ["row", "column", "rule", "message", "value", "normalized_value"]
+
+# Content type and file suffix of each error report format
+ERROR_REPORT_FORMATS = {
+    "ndjson": ("application/x-ndjson", ".ndjson"),
+    "csv": ("text/csv", ".csv"),
+}
+
+
+class ValidationErrorReport:
+    """
+    Row-level validation errors of the Manual Sheet.
+
+    Each failing cell is one record with its row number, column header,
+    rule, message, original value and normalized value. Records are written
+    ordered by row, in rule order within a row.
+    """
+
+    def __init__(self):
+        self.errors: List[Dict[str, Any]] = []
+
+    def __len__(self) -> int:
+        return len(self.errors)
+
+    def add(self, row: int, column: str, rule: str, message: str, value: Any, normalized_value: Any):
+        """Record a failing cell"""
+        self.errors.append({
+            "row": row,
+            "column": column,
+            "rule": rule,
+            "message": message,
+            "value": value,
+            "normalized_value": normalized_value,
+        })
+
+    def write(self, output_format: str) -> BinaryIO:
+        """
+        Write the errors to a spooled temporary file.
+
+        Args:
+            output_format: "ndjson" or "csv"
+
+        Returns:
+            BinaryIO: The report, positioned at its start
+
+        Raises:
+            ValueError: If the format is not supported
+        """
+        if output_format not in ERROR_REPORT_FORMATS:
+            raise ValueError(f"Unsupported error report format: {output_format}")
+
+        output = tempfile.SpooledTemporaryFile(max_size=settings.download_spool_max_size)
+        text = io.TextIOWrapper(output, encoding="utf-8", newline="")
+        errors = sorted(self.errors, key=lambda error: error["row"])
+        if output_format == "ndjson":
+            for error in errors:
+                text.write(json.dumps(error, default=str, ensure_ascii=False) + "\n")
+        else:
+            writer = csv.DictWriter(text, fieldnames=ERROR_REPORT_FIELDS)
+            writer.writeheader()
+            writer.writerows(errors)
+        text.flush()
+        # The report outlives the wrapper, which would close it
+        text.detach()
+        output.seek(0)
+        return output
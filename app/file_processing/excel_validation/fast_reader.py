@@ -0,0 +1,267 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple, Union
+from xml.etree import ElementTree
+from openpyxl.styles.numbers import BUILTIN_FORMATS, is_date_format, is_timedelta_format
+from openpyxl.utils.datetime import MAC_EPOCH, WINDOWS_EPOCH, from_excel, from_ISO8601
+from app.utils.logger import logger
+
+SHEET_MAIN_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+RELATIONSHIPS_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+PACKAGE_RELATIONSHIPS_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+ROW_TAG = f"{SHEET_MAIN_NS}row"
+CELL_TAG = f"{SHEET_MAIN_NS}c"
+VALUE_TAG = f"{SHEET_MAIN_NS}v"
+TEXT_TAG = f"{SHEET_MAIN_NS}t"
+RUN_TAG = f"{SHEET_MAIN_NS}r"
+INLINE_STRING_TAG = f"{SHEET_MAIN_NS}is"
+SHARED_STRING_TAG = f"{SHEET_MAIN_NS}si"
+
+# Columns of values of a sheet, each one indexed by row - 1
+Columns = List[List[Any]]
+
+
+def split_reference(reference: str) -> Tuple[int, int]:
+    """1-based (row, column) of a cell reference such as 'AB12'."""
+    column = 0
+    for position, char in enumerate(reference):
+        if char.isdigit():
+            return int(reference[position:]), column
+        column = column * 26 + ord(char) - 64
+    return 0, column
+
+
+def rich_text(element: ElementTree.Element) -> str:
+    """Text of a shared or inline string, without its phonetic runs."""
+    text = element.find(TEXT_TAG)
+    if text is not None:
+        return text.text or ""
+    return "".join(run.findtext(TEXT_TAG) or "" for run in element.iter(RUN_TAG))
+
+
+def read_shared_strings(archive: zipfile.ZipFile) -> List[str]:
+    """Read the shared strings table of the workbook."""
+    if "xl/sharedStrings.xml" not in archive.namelist():
+        return []
+    strings = []
+    with archive.open("xl/sharedStrings.xml") as part:
+        for _, element in ElementTree.iterparse(part):
+            if element.tag == SHARED_STRING_TAG:
+                strings.append(rich_text(element))
+                element.clear()
+    return strings
+
+
+def read_date_styles(archive: zipfile.ZipFile) -> Dict[int, bool]:
+    """
+    Find the cell formats that display numbers as dates.
+
+    Returns:
+        Index of each date format in cellXfs, mapped to True when it is a duration
+    """
+    if "xl/styles.xml" not in archive.namelist():
+        return {}
+    root = ElementTree.fromstring(archive.read("xl/styles.xml"))
+    number_formats = dict(BUILTIN_FORMATS)
+    for number_format in root.iter(f"{SHEET_MAIN_NS}numFmt"):
+        number_formats[int(number_format.get("numFmtId"))] = number_format.get("formatCode")
+
+    date_styles = {}
+    cell_formats = root.find(f"{SHEET_MAIN_NS}cellXfs")
+    if cell_formats is not None:
+        for index, cell_format in enumerate(cell_formats.findall(f"{SHEET_MAIN_NS}xf")):
+            format_code = number_formats.get(int(cell_format.get("numFmtId", 0)))
+            if format_code and is_date_format(format_code):
+                date_styles[index] = is_timedelta_format(format_code)
+    return date_styles
+
+
+def read_sheet_parts(archive: zipfile.ZipFile) -> Tuple[Dict[str, str], Any]:
+    """
+    Locate the part of each sheet in the zip container.
+
+    Returns:
+        Part path by sheet name, in workbook order, and the date epoch of the workbook
+    """
+    workbook = ElementTree.fromstring(archive.read("xl/workbook.xml"))
+    relationships = {
+        element.get("Id"): element.get("Target")
+        for element in ElementTree.fromstring(archive.read("xl/_rels/workbook.xml.rels"))
+        if element.tag == f"{PACKAGE_RELATIONSHIPS_NS}Relationship"
+    }
+
+    parts = {}
+    for sheet in workbook.iter(f"{SHEET_MAIN_NS}sheet"):
+        target = relationships.get(sheet.get(f"{RELATIONSHIPS_NS}id"), "")
+        parts[sheet.get("name")] = target.lstrip("/") if target.startswith("/") else f"xl/{target}"
+
+    properties = workbook.find(f"{SHEET_MAIN_NS}workbookPr")
+    date1904 = properties is not None and properties.get("date1904") in ("1", "true")
+    return parts, MAC_EPOCH if date1904 else WINDOWS_EPOCH
+
+
+def cast_number(value: str) -> Union[int, float]:
+    """Convert a numeric cell value the way openpyxl does."""
+    if "." in value or "E" in value or "e" in value:
+        return float(value)
+    return int(value)
+
+
+def parse_sheet(
+    archive: zipfile.ZipFile,
+    part: str,
+    shared_strings: List[str],
+    date_styles: Dict[int, bool],
+    epoch: Any,
+) -> Columns:
+    """
+    Read the values of a sheet into columns with a single streaming pass.
+
+    Formula cells hold their last calculated value. Styles are only used to
+    convert numbers displayed as dates.
+
+    Returns:
+        Values of the sheet, one list per column, each indexed by row - 1
+    """
+    columns: Columns = []
+    current_row = col_idx = 0
+    with archive.open(part) as sheet_xml:
+        for event, element in ElementTree.iterparse(sheet_xml, events=("start", "end")):
+            if element.tag == ROW_TAG:
+                # The row number is needed by its cells, before the row ends
+                if event == "start":
+                    row_number = element.get("r")
+                    current_row = int(row_number) if row_number else current_row + 1
+                    col_idx = 0
+                else:
+                    element.clear()
+                continue
+            if event != "end" or element.tag != CELL_TAG:
+                continue
+
+            # Cells without reference follow the previous cell of the row
+            reference = element.get("r")
+            if reference:
+                row_idx, col_idx = split_reference(reference)
+            else:
+                row_idx, col_idx = current_row, col_idx + 1
+            data_type = element.get("t", "n")
+            if data_type == "inlineStr":
+                inline = element.find(INLINE_STRING_TAG)
+                value = rich_text(inline) if inline is not None else None
+            else:
+                value = element.findtext(VALUE_TAG) or None
+                if value is not None:
+                    if data_type == "n":
+                        value = cast_number(value)
+                        style = element.get("s")
+                        if style is not None and int(style) in date_styles:
+                            value = from_excel(value, epoch, timedelta=date_styles[int(style)])
+                    elif data_type == "s":
+                        value = shared_strings[int(value)]
+                    elif data_type == "b":
+                        value = value == "1"
+                    elif data_type == "d":
+                        value = from_ISO8601(value)
+            element.clear()
+
+            if value is None:
+                continue
+            while len(columns) < col_idx:
+                columns.append([])
+            column = columns[col_idx - 1]
+            if len(column) < row_idx - 1:
+                column.extend([None] * (row_idx - 1 - len(column)))
+            column.append(value)
+    return columns
+
+
+def read_sheets_from_path(path: str, names: List[str]) -> Dict[str, Columns]:
+    """Read sheets of an xlsx file on disk, used by the worker processes."""
+    with open(path, "rb") as file_content:
+        return read_sheets(file_content, names)
+
+
+def worker_context():
+    """
+    Multiprocessing context of the reader processes.
+
+    The service runs several threads (DB pool, poller, heartbeats), so
+    workers are not forked from it: they start from a fork server, or are
+    spawned where that is not available.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+def read_sheets_in_processes(file_content: BinaryIO, names: List[str], processes: int) -> Dict[str, Columns]:
+    """
+    Parse each sheet in its own worker process.
+
+    The file is copied once to a temporary file on disk that the workers
+    open by path, so its content is not sent to each worker.
+    """
+    workers = min(processes, len(names))
+    logger.info(f"Reading {len(names)} sheets in {workers} processes")
+    file_content.seek(0)
+    with tempfile.NamedTemporaryFile(suffix=".xlsx", delete=False) as copy:
+        shutil.copyfileobj(file_content, copy)
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=worker_context()) as executor:
+            sheets = {}
+            for result in executor.map(read_sheets_from_path, [copy.name] * len(names), [[name] for name in names]):
+                sheets.update(result)
+            return sheets
+    finally:
+        os.unlink(copy.name)
+
+
+def read_sheets(
+    file_content: BinaryIO,
+    names: Optional[List[str]] = None,
+    processes: int = 1,
+) -> Dict[str, Columns]:
+    """
+    Read the values of several sheets of an xlsx file, without styles.
+
+    The sheet parts and the shared strings table are parsed straight from
+    the zip container. With more than one process, each sheet is parsed
+    in its own worker process, see read_sheets_in_processes.
+
+    Args:
+        file_content: Seekable binary xlsx file
+        names: Sheets to read, all of them if not given
+        processes: Maximum number of worker processes
+
+    Returns:
+        Columns of values of each sheet, by sheet name
+
+    Raises:
+        KeyError: If one of the sheets does not exist
+    """
+    file_content.seek(0)
+    try:
+        with zipfile.ZipFile(file_content) as archive:
+            parts, epoch = read_sheet_parts(archive)
+            names = list(parts) if names is None else names
+            for name in names:
+                if name not in parts:
+                    raise KeyError(f"Worksheet {name} does not exist.")
+
+            if processes > 1 and len(names) > 1:
+                return read_sheets_in_processes(file_content, names, processes)
+
+            shared_strings = read_shared_strings(archive)
+            date_styles = read_date_styles(archive)
+            return {
+                name: parse_sheet(archive, parts[name], shared_strings, date_styles, epoch)
+                for name in names
+            }
+    finally:
+        file_content.seek(0)
@@ -0,0 +1,426 @@
+import io
+import re
+import threading
+import zipfile
+from copy import copy, deepcopy
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+from xml.etree import ElementTree
+from xml.sax.saxutils import unescape
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import PatternFill
+from app.core.config import settings
+from app.file_processing.excel_validation.annotations import LEFT_ALIGNMENT, NO_FILL
+from app.file_processing.excel_validation.fast_reader import read_sheets
+from app.file_processing.excel_validation.loader import read_sheet_names
+from app.utils.logger import logger
+
+WORKBOOK_PART = "xl/workbook.xml"
+WORKBOOK_RELS_PART = "xl/_rels/workbook.xml.rels"
+SHEET_ELEMENT = re.compile(rb'<(?:\w+:)?sheet\s[^>]*?/>')
+SHEET_NAME = re.compile(rb'\sname="([^"]*)"')
+SHEET_RID = re.compile(rb'\s\w+:id="([^"]*)"')
+DEFINED_NAMES = re.compile(rb'<(?:\w+:)?definedNames\b.*?</(?:\w+:)?definedNames>|<(?:\w+:)?definedNames\s*/>', re.S)
+BOOK_VIEW_TAB = re.compile(rb'\s(?:activeTab|firstSheet)="\d+"')
+
+
+class ValueCell:
+    """Read-only cell of a ValuesWorksheet, exposing the attributes read by the pipeline."""
+
+    __slots__ = ("row", "column", "value")
+
+    def __init__(self, row: int, column: int, value: Any):
+        self.row = row
+        self.column = column
+        self.value = value
+
+
+class ValuesWorksheet:
+    """
+    Values-only copy of a worksheet, stored column by column.
+
+    Implements the subset of the openpyxl Worksheet interface used by the
+    validator and the database load: `max_row`, `max_column`, `iter_rows`,
+    `ws[row]` and `ws.cell(row, column)`. Whole columns are available with
+    `column_values`.
+    """
+
+    def __init__(self, title: str, columns: List[List[Any]]):
+        self.title = title
+        self._columns = columns
+        self.max_column = len(columns)
+        self.max_row = max((len(column) for column in columns), default=0)
+        # Trailing empty rows do not count, as with a loaded worksheet
+        while self.max_row and all(
+            len(column) < self.max_row or column[self.max_row - 1] is None for column in columns
+        ):
+            self.max_row -= 1
+
+    @classmethod
+    def from_rows(cls, title: str, rows: Iterable[Tuple[Any, ...]]) -> "ValuesWorksheet":
+        """Build the sheet from rows of values, as yielded by `iter_rows(values_only=True)`."""
+        columns: List[List[Any]] = []
+        for row_idx, row in enumerate(rows):
+            for col_idx, value in enumerate(row):
+                if col_idx == len(columns):
+                    columns.append([None] * row_idx)
+                column = columns[col_idx]
+                column.extend([None] * (row_idx - len(column)))
+                column.append(value)
+        return cls(title, columns)
+
+    def _value(self, row: int, column: int) -> Any:
+        if 1 <= column <= self.max_column and 1 <= row <= self.max_row:
+            values = self._columns[column - 1]
+            if row <= len(values):
+                return values[row - 1]
+        return None
+
+    def column_values(self, column: int, min_row: int = 1) -> List[Any]:
+        """Values of a column from `min_row` to `max_row`, padded with None."""
+        values = self._columns[column - 1][min_row - 1:self.max_row] if 1 <= column <= self.max_column else []
+        return values + [None] * (self.max_row - min_row + 1 - len(values))
+
+    def cell(self, row: int, column: int) -> ValueCell:
+        return ValueCell(row, column, self._value(row, column))
+
+    def __getitem__(self, row: int) -> Tuple[ValueCell, ...]:
+        return tuple(
+            ValueCell(row, column, self._value(row, column))
+            for column in range(1, self.max_column + 1)
+        )
+
+    def iter_rows(
+        self,
+        min_row: Optional[int] = None,
+        max_row: Optional[int] = None,
+        min_col: Optional[int] = None,
+        max_col: Optional[int] = None,
+        values_only: bool = False,
+    ) -> Iterator[Tuple[Any, ...]]:
+        min_row = min_row or 1
+        max_row = max_row or self.max_row
+        min_col = min_col or 1
+        max_col = max_col or self.max_column
+        for row in range(min_row, max_row + 1):
+            if values_only:
+                yield tuple(self._value(row, column) for column in range(min_col, max_col + 1))
+            else:
+                yield tuple(
+                    ValueCell(row, column, self._value(row, column))
+                    for column in range(min_col, max_col + 1)
+                )
+
+
+class ExpandedCell(ValueCell):
+    """Cell of an ExpandedWorksheet, styled and commented as its source cell"""
+
+    __slots__ = ("fill", "comment")
+
+    def __init__(self, row: int, column: int, value: Any, fill: PatternFill, comment):
+        super().__init__(row, column, value)
+        self.fill = fill
+        self.comment = comment
+
+
+class ExpandedWorksheet:
+    """
+    Rows of a writable worksheet after expansion, without rewriting the worksheet.
+
+    Each row keeps the number of the source row it was built from; cell
+    styles and comments are read from that source row, so annotations
+    follow their row when earlier rows are expanded. Implements the same
+    read interface as ValuesWorksheet.
+    """
+
+    def __init__(self, source, rows: List[Tuple[int, List[Any]]]):
+        self.source = source
+        self.title = source.title
+        self.rows = rows
+        self.max_row = len(rows)
+        self.max_column = max((len(values) for _, values in rows), default=0)
+
+    def source_row(self, row: int) -> int:
+        """Number of the source row of an expanded row"""
+        return self.rows[row - 1][0]
+
+    def _value(self, row: int, column: int) -> Any:
+        if 1 <= row <= self.max_row:
+            values = self.rows[row - 1][1]
+            if 1 <= column <= len(values):
+                return values[column - 1]
+        return None
+
+    def cell(self, row: int, column: int) -> ExpandedCell:
+        source_cell = None
+        if 1 <= row <= self.max_row:
+            # Existing cells only, reading must not create cells in the source
+            source_cell = self.source._cells.get((self.source_row(row), column))
+        if source_cell is None:
+            return ExpandedCell(row, column, self._value(row, column), NO_FILL, None)
+        return ExpandedCell(row, column, self._value(row, column), source_cell.fill, source_cell.comment)
+
+    def __getitem__(self, row: int) -> Tuple[ExpandedCell, ...]:
+        return tuple(self.cell(row, column) for column in range(1, self.max_column + 1))
+
+    def column_values(self, column: int, min_row: int = 1) -> List[Any]:
+        return [self._value(row, column) for row in range(min_row, self.max_row + 1)]
+
+    def iter_rows(
+        self,
+        min_row: Optional[int] = None,
+        max_row: Optional[int] = None,
+        min_col: Optional[int] = None,
+        max_col: Optional[int] = None,
+        values_only: bool = False,
+    ) -> Iterator[Tuple[Any, ...]]:
+        min_col = min_col or 1
+        max_col = max_col or self.max_column
+        for row in range(min_row or 1, (max_row or self.max_row) + 1):
+            if values_only:
+                yield tuple(self._value(row, column) for column in range(min_col, max_col + 1))
+            else:
+                yield tuple(self.cell(row, column) for column in range(min_col, max_col + 1))
+
+
+def trim_workbook(file_content: BinaryIO, keep_sheets: List[str]) -> io.BytesIO:
+    """
+    Build a copy of an xlsx file that only declares the given sheets.
+
+    The other sheets are removed from 'xl/workbook.xml' and their parts are
+    left out of the copy, so openpyxl never parses them. Defined names are
+    dropped because they may refer to the removed sheets.
+
+    Args:
+        file_content: Seekable binary xlsx file
+        keep_sheets: Names of the sheets to keep
+
+    Returns:
+        The trimmed xlsx file, positioned at its start
+    """
+    file_content.seek(0)
+    output = io.BytesIO()
+    with zipfile.ZipFile(file_content) as source:
+        workbook_xml = source.read(WORKBOOK_PART)
+        dropped_ids = set()
+
+        def drop_sheet(match):
+            name = SHEET_NAME.search(match.group(0))
+            if name and unescape(name.group(1).decode("utf-8"), {"&quot;": '"', "&apos;": "'"}) in keep_sheets:
+                return match.group(0)
+            rid = SHEET_RID.search(match.group(0))
+            if rid:
+                dropped_ids.add(rid.group(1).decode("utf-8"))
+            return b""
+
+        workbook_xml = SHEET_ELEMENT.sub(drop_sheet, workbook_xml)
+        workbook_xml = DEFINED_NAMES.sub(b"", workbook_xml)
+        workbook_xml = BOOK_VIEW_TAB.sub(b"", workbook_xml)
+
+        dropped_parts = set()
+        for element in ElementTree.fromstring(source.read(WORKBOOK_RELS_PART)):
+            if element.get("Id") in dropped_ids:
+                target = element.get("Target", "")
+                dropped_parts.add(target.lstrip("/") if target.startswith("/") else f"xl/{target}")
+
+        with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as destination:
+            for item in source.infolist():
+                if item.filename in dropped_parts:
+                    continue
+                if item.filename == WORKBOOK_PART:
+                    destination.writestr(item, workbook_xml)
+                else:
+                    destination.writestr(item, source.read(item.filename))
+    file_content.seek(0)
+    output.seek(0)
+    return output
+
+
+class LazyWorkbook:
+    """
+    Workbook loaded sheet by sheet, for files where only a few sheets are edited.
+
+    The writable sheets are loaded with styles and comments into an editable
+    openpyxl Workbook that contains nothing else. Every other sheet is a
+    ValuesWorksheet read with the read-only streaming reader (or the fast
+    reader, see EXCEL_READER_ENGINE) the first time it is accessed.
+
+    Writable sheets can be expanded into an ExpandedWorksheet instead of
+    being rewritten in place. Saving streams every sheet, in the original
+    order, through a write-only workbook: writable sheets with their
+    formatting and annotations, reference sheets as plain values.
+
+    Of the sheet-level properties of a writable sheet, saving keeps column
+    widths, row heights, hidden and outline levels, merged cells, freeze
+    panes and other sheet views, data validation, conditional formatting,
+    the auto filter, the tab color and print margins and options; they stay
+    at their original coordinates, as after an in-place rewrite. Hyperlinks,
+    images, charts, tables, sheet protection, page setup and headers are
+    dropped.
+    """
+
+    def __init__(self, file_content: BinaryIO, writable_sheets: List[str]):
+        self.file = file_content
+        self.sheetnames: List[str] = read_sheet_names(file_content)
+        self.writable_sheets = [name for name in writable_sheets if name in self.sheetnames]
+        self._writable: Optional[Workbook] = None
+        self._reader = None
+        self._values: Dict[str, ValuesWorksheet] = {}
+        self._expanded: Dict[str, ExpandedWorksheet] = {}
+        self._lock = threading.RLock()
+
+    @property
+    def writable(self) -> Workbook:
+        """Editable workbook holding only the writable sheets, loaded on first access."""
+        with self._lock:
+            if self._writable is None:
+                logger.info(f"Loading writable sheets: {self.writable_sheets}")
+                self._writable = load_workbook(trim_workbook(self.file, self.writable_sheets))
+            return self._writable
+
+    def values_sheet(self, name: str) -> ValuesWorksheet:
+        """
+        Values-only copy of a reference sheet, read on first access.
+
+        With the "fast" EXCEL_READER_ENGINE every reference sheet is read on
+        the first access, so they can be parsed in parallel processes.
+        """
+        with self._lock:
+            if name not in self._values and settings.excel_reader_engine == "fast":
+                names = [
+                    sheet for sheet in self.sheetnames
+                    if sheet not in self.writable_sheets and sheet not in self._values
+                ]
+                logger.info(f"Reading values of sheets {names}")
+                for sheet, columns in read_sheets(
+                    self.file, names, processes=settings.excel_reader_processes
+                ).items():
+                    self._values[sheet] = ValuesWorksheet(sheet, columns)
+            if name not in self._values:
+                if self._reader is None:
+                    self.file.seek(0)
+                    self._reader = load_workbook(self.file, read_only=True)
+                logger.info(f"Reading values of sheet '{name}'")
+                self._values[name] = ValuesWorksheet.from_rows(
+                    name, self._reader[name].iter_rows(values_only=True)
+                )
+                if len(self._values) == len(self.sheetnames) - len(self.writable_sheets):
+                    self.close_reader()
+            return self._values[name]
+
+    def close_reader(self):
+        """Release the streaming reader once every reference sheet has been read."""
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.sheetnames
+
+    def __getitem__(self, name: str):
+        if name not in self.sheetnames:
+            raise KeyError(f"Worksheet {name} does not exist.")
+        if name in self._expanded:
+            return self._expanded[name]
+        if name in self.writable_sheets:
+            return self.writable[name]
+        return self.values_sheet(name)
+
+    def expand_sheet(self, name: str, rows: List[Tuple[int, List[Any]]]) -> ExpandedWorksheet:
+        """
+        Replace a writable sheet by its expanded rows, for reading and saving.
+
+        Args:
+            name: Name of the writable sheet
+            rows: (source row, values) of each row of the expanded sheet
+
+        Returns:
+            ExpandedWorksheet: The sheet now returned by `workbook[name]`
+        """
+        with self._lock:
+            self._expanded[name] = ExpandedWorksheet(self.writable[name], rows)
+            return self._expanded[name]
+
+    def save(self, output: BinaryIO):
+        """
+        Stream every sheet to an xlsx file with a write-only workbook.
+
+        Args:
+            output: Binary file or path to write the xlsx file to
+        """
+        with self._lock:
+            wb = Workbook(write_only=True)
+            for name in self.sheetnames:
+                ws = wb.create_sheet(name)
+                if name in self.writable_sheets:
+                    self._write_styled_sheet(ws, name)
+                else:
+                    for row in self.values_sheet(name).iter_rows(values_only=True):
+                        ws.append(row)
+            wb.save(output)
+            self.close_reader()
+
+    @staticmethod
+    def _copy_sheet_properties(source, ws):
+        """Copy the sheet-level properties a write-only worksheet can hold, see the class notes"""
+        for key, dimension in source.column_dimensions.items():
+            target = ws.column_dimensions[key]
+            target.width = dimension.width
+            target.hidden = dimension.hidden
+            target.outline_level = dimension.outline_level
+            target.min, target.max = dimension.min, dimension.max
+        for row_idx, dimension in source.row_dimensions.items():
+            target = ws.row_dimensions[row_idx]
+            target.height = dimension.height
+            target.hidden = dimension.hidden
+            target.outline_level = dimension.outline_level
+
+        for merged_range in source.merged_cells.ranges:
+            ws.merged_cells.add(merged_range.coord)
+        for validation in source.data_validations.dataValidation:
+            ws.data_validations.append(deepcopy(validation))
+        for formatting in source.conditional_formatting:
+            for rule in formatting.rules:
+                ws.conditional_formatting.add(str(formatting.sqref), deepcopy(rule))
+
+        ws.views = deepcopy(source.views)
+        ws.sheet_format = copy(source.sheet_format)
+        ws.sheet_properties = deepcopy(source.sheet_properties)
+        ws.auto_filter.ref = source.auto_filter.ref
+        ws.print_options = copy(source.print_options)
+        ws.page_margins = copy(source.page_margins)
+
+    def _write_styled_sheet(self, ws, name: str):
+        """Stream a writable sheet, or its expansion, with the styles and comments of its cells"""
+        source = self.writable[name]
+        expanded = self._expanded.get(name)
+        rows = expanded.rows if expanded else [
+            (row_idx, list(values)) for row_idx, values in enumerate(source.iter_rows(values_only=True), 1)
+        ]
+
+        self._copy_sheet_properties(source, ws)
+
+        # Style objects copied once per distinct source style
+        styles = {}
+        for source_row, values in rows:
+            cells = []
+            for col_idx, value in enumerate(values, 1):
+                cell = WriteOnlyCell(ws, value=value)
+                source_cell = source._cells.get((source_row, col_idx))
+                if source_cell is not None:
+                    if source_cell.has_style:
+                        key = tuple(source_cell._style)
+                        if key not in styles:
+                            styles[key] = (
+                                copy(source_cell.font), copy(source_cell.border), copy(source_cell.fill),
+                                source_cell.number_format, copy(source_cell.protection),
+                                copy(source_cell.alignment),
+                            )
+                        (cell.font, cell.border, cell.fill, cell.number_format,
+                         cell.protection, cell.alignment) = styles[key]
+                    if source_cell.comment is not None:
+                        cell.comment = source_cell.comment
+                if expanded:
+                    cell.alignment = LEFT_ALIGNMENT
+                cells.append(cell)
+            ws.append(cells)
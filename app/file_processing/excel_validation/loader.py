@@ -1,33 +1,48 @@
+import io
 import os
-from datetime import datetime
-from google.cloud import storage
+import zipfile
+from typing import BinaryIO, List, Union
+from xml.etree import ElementTree
+from app.file_processing.storage import get_storage_backend
 from app.utils.logger import logger
 
-def backup_file_to_gcs(bucket_name: str, file_path: str, file_content: bytes) -> str:
+MOTHER_PARKERS_REQUIRED_SHEETS = [
+    "Manual Sheet", 
+    "Single Supplier Table", 
+    "Worksheet- Coffee", 
+    "Worksheet- Tea"
+]
+# Sheets annotated by the validation, every other sheet is only read
+MOTHER_PARKERS_WRITABLE_SHEETS = ["Manual Sheet"]
+
+def backup_file_to_gcs(bucket_name: str, file_path: str, content_sha256: str) -> str:
     """
     Creates a backup of the file in a 'backups' directory in the same GCS bucket.
     
+    Backups are content-addressed (backups/<sha256><ext>) and made with a
+    server-side copy of the original object, so no bytes are uploaded and
+    an identical workbook is only backed up once.
+    
     Args:
         bucket_name: Name of the GCS bucket
         file_path: Path of the file in the bucket
-        file_content: File content as bytes
+        content_sha256: SHA-256 hex digest of the file content
     
     Returns:
         Backup file path
     """
     try:
         # Create backup path
-        file_name = os.path.basename(file_path)
-        file_base, file_ext = os.path.splitext(file_name)
-        timestamp = datetime.now().strftime('%Y_%m_%d_%H_%M_%S')
-        backup_name = f"{file_base}_{timestamp}{file_ext}"
-        backup_path = f"backups/{backup_name}"
+        file_ext = os.path.splitext(file_path)[1].lower()
+        backup_path = f"backups/{content_sha256}{file_ext}"
+        
+        storage_backend = get_storage_backend()
+        if storage_backend.exists(bucket_name, backup_path):
+            logger.info(f"Backup already exists at gs://{bucket_name}/{backup_path}")
+            return backup_path
         
-        # Upload backup to GCS
-        client = storage.Client()
-        bucket = client.bucket(bucket_name)
-        blob = bucket.blob(backup_path)
-        blob.upload_from_string(file_content)
+        # Copy the original object to the backup path
+        storage_backend.copy(bucket_name, file_path, bucket_name, backup_path)
         
         logger.info(f"Created backup at gs://{bucket_name}/{backup_path}")
         return backup_path
@@ -47,36 +62,67 @@ def is_excel_file(file_path: str) -> bool:
     """
     return file_path.lower().endswith((".xlsx", ".xls"))
 
-def is_mother_parkers_format(file_content: bytes) -> bool:
+def read_sheet_names(file_content: Union[bytes, BinaryIO]) -> List[str]:
+    """
+    Read the sheet names of an xlsx file from 'xl/workbook.xml' in its zip container.
+    
+    Only the zip directory and the workbook part are read, so it takes
+    constant time and memory whatever the size of the sheets.
+    
+    Args:
+        file_content: File content as bytes or seekable binary file
+    
+    Returns:
+        Sheet names in workbook order
+    
+    Raises:
+        zipfile.BadZipFile, KeyError: If the file is not an xlsx container
+    """
+    if isinstance(file_content, bytes):
+        file_content = io.BytesIO(file_content)
+    file_content.seek(0)
+    try:
+        with zipfile.ZipFile(file_content) as archive:
+            with archive.open("xl/workbook.xml") as workbook_xml:
+                return [
+                    element.get("name")
+                    for _, element in ElementTree.iterparse(workbook_xml)
+                    if element.tag.rsplit("}", 1)[-1] == "sheet"
+                ]
+    finally:
+        file_content.seek(0)
+
+def has_mother_parkers_sheets(sheet_names: List[str]) -> bool:
+    """
+    Check if a workbook with the given sheets follows the Mother Parkers format.
+    
+    Args:
+        sheet_names: Sheet names of the workbook
+    
+    Returns:
+        True if all the required sheets are present, False otherwise
+    """
+    # Check if all required sheets exist
+    for sheet in MOTHER_PARKERS_REQUIRED_SHEETS:
+        if sheet not in sheet_names:
+            logger.info(f"Missing sheet '{sheet}', not a Mother Parkers format Excel file")
+            return False
+    
+    logger.info("File identified as Mother Parkers format Excel file")
+    return True
+
+def is_mother_parkers_format(file_content: Union[bytes, BinaryIO]) -> bool:
     """
     Check if the Excel file follows the Mother Parkers format by having the required sheets.
     
     Args:
-        file_content: File content as bytes
+        file_content: File content as bytes or seekable binary file
     
     Returns:
         True if the file has the required sheets, False otherwise
     """
     try:
-        import io
-        from openpyxl import load_workbook
-        
-        wb = load_workbook(io.BytesIO(file_content))
-        required_sheets = [
-            "Manual Sheet", 
-            "Single Supplier Table", 
-            "Worksheet- Coffee", 
-            "Worksheet- Tea"
-        ]
-        
-        # Check if all required sheets exist
-        for sheet in required_sheets:
-            if sheet not in wb.sheetnames:
-                logger.info(f"Missing sheet '{sheet}', not a Mother Parkers format Excel file")
-                return False
-        
-        logger.info("File identified as Mother Parkers format Excel file")
-        return True
+        return has_mother_parkers_sheets(read_sheet_names(file_content))
     except Exception as e:
         logger.error(f"Error checking Excel format: {e}")
         return False
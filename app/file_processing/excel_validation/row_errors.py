@@ -0,0 +1,68 @@
+from typing import List, Optional
+import numpy as np
+import pandas as pd
+from app.file_processing.excel_validation.error_report import ValidationErrorReport
+
+
+class RowErrors:
+    """
+    Error bitmap of the Manual Sheet, one row per sheet row and one column per rule.
+
+    Rows are looked up by their number in the Manual Sheet as loaded into
+    the database, which may be expanded from the validated sheet; each
+    expanded row maps to the source row whose cells were validated.
+    """
+
+    def __init__(self, rules: List[str], rows: int):
+        """
+        Args:
+            rules: Names of the rules, in column order
+            rows: Number of rows of the validated sheet
+        """
+        self.rules = list(rules)
+        self._rule_columns = {rule: col_idx for col_idx, rule in enumerate(self.rules)}
+        # Indexed by row number, row 0 is unused
+        self.matrix = np.zeros((rows + 1, len(self.rules)), dtype=bool)
+        self.source_rows: Optional[np.ndarray] = None
+
+    @classmethod
+    def from_report(cls, report: ValidationErrorReport, rules: List[str], rows: int) -> "RowErrors":
+        """Bitmap of the failing cells recorded in an error report"""
+        row_errors = cls(rules, rows)
+        for error in report.errors:
+            row_errors.mark(error["row"], error["rule"])
+        return row_errors
+
+    @classmethod
+    def from_mask(cls, mask: pd.DataFrame, rules: List[str], rows: int) -> "RowErrors":
+        """Bitmap of a row x rule error mask indexed by row number, rules missing from it never fail"""
+        row_errors = cls(rules, rows)
+        for rule in mask.columns:
+            row_errors.matrix[mask.index[mask[rule]].to_numpy(), row_errors._rule_columns[rule]] = True
+        return row_errors
+
+    def set_source_rows(self, source_rows: Optional[List[int]]):
+        """Map rows of the expanded sheet, from row 1, to their source row"""
+        self.source_rows = None if source_rows is None else np.array([0] + list(source_rows), dtype=np.int64)
+
+    def mark(self, row: int, rule: str):
+        """Record a failure of a rule on a source row"""
+        self.matrix[row, self._rule_columns[rule]] = True
+
+    def source_row(self, row: int) -> int:
+        """Source row of a row of the expanded sheet"""
+        if self.source_rows is None:
+            return row
+        return int(self.source_rows[row]) if row < len(self.source_rows) else 0
+
+    def is_valid(self, row: int) -> bool:
+        """True when no rule failed on the source row of a row"""
+        source_row = self.source_row(row)
+        return not (0 < source_row < len(self.matrix) and self.matrix[source_row].any())
+
+    def failed_rules(self, row: int) -> List[str]:
+        """Names of the rules that failed on the source row of a row"""
+        source_row = self.source_row(row)
+        if not 0 < source_row < len(self.matrix):
+            return []
+        return [rule for rule, failed in zip(self.rules, self.matrix[source_row]) if failed]
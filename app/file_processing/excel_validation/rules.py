@@ -0,0 +1,55 @@
+from typing import Any, Callable, List, Set
+
+
+class ReferenceSet:
+    """Normalized values of a column gathered from one or more reference sheets"""
+
+    def __init__(self, name: str, sheets: List[str], column: str, normalizer: Callable[[Any], str]):
+        self.name = name
+        self.sheets = sheets
+        self.column = column
+        self.normalizer = normalizer
+
+
+class ValidationRule:
+    """
+    Declarative check of a Manual Sheet column against a reference set.
+
+    A cell fails when its normalized value is not in the reference set; it
+    is then marked with `message` and counted in the ValidationStats
+    attribute named by `stat`. A rule whose reference set is empty or whose
+    column is missing is skipped.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        column: str,
+        normalizer: Callable[[Any], str],
+        reference: ReferenceSet,
+        message: str,
+        stat: str,
+        log_failures: bool = True,
+        counts_as_multiple_error: bool = False,
+    ):
+        self.name = name
+        self.column = column
+        self.normalizer = normalizer
+        self.reference = reference
+        self.message = message
+        self.stat = stat
+        self.log_failures = log_failures
+        # Failing rows are also recorded in ValidationStats.multiple_errors
+        self.counts_as_multiple_error = counts_as_multiple_error
+
+
+class CompiledRule:
+    """Rule bound to a column position and to its loaded reference values"""
+
+    def __init__(self, rule: ValidationRule, header_row: int, column: int, reference_values: Set[str]):
+        self.rule = rule
+        self.header_row = header_row
+        self.column = column
+        self.reference_values = reference_values
+        # Distinct raw values that failed the rule
+        self.not_found: Set[Any] = set()
@@ -0,0 +1,124 @@
+import weakref
+from typing import Any, Dict, List, Optional, Tuple
+
+# Rows searched for column headers at the top of a sheet
+HEADER_SEARCH_ROWS = 5
+
+
+class SheetTable:
+    """
+    Header index and column-wise value access of a worksheet.
+
+    The header rows are read once when the table is built; column values
+    are read from the worksheet on each call, so they reflect later edits
+    of writable sheets. `find` and `header_row` only look at the header
+    rows, `locate` falls back to the whole sheet. Works with openpyxl
+    worksheets and ValuesWorksheet.
+    """
+
+    def __init__(self, sheet, header_rows: int = HEADER_SEARCH_ROWS):
+        self.sheet = sheet
+        self.header_values: List[Tuple[Any, ...]] = list(
+            sheet.iter_rows(min_row=1, max_row=min(header_rows, sheet.max_row), values_only=True)
+        )
+        # First position of each header value, scanning rows top to bottom
+        self.positions: Dict[Any, Tuple[int, int]] = {}
+        for row_idx, row in enumerate(self.header_values, 1):
+            for col_idx, value in enumerate(row, 1):
+                if value is not None and value not in self.positions:
+                    self.positions[value] = (row_idx, col_idx)
+        self._columns: Dict[int, Dict[Any, int]] = {}
+        # Outcome of the full-sheet search of headers missing from the header rows
+        self._located: Dict[str, Optional[Tuple[int, int]]] = {}
+
+    def find(self, column_name: str) -> Optional[Tuple[int, int]]:
+        """
+        Find a column header.
+
+        Returns:
+            (row, column) of the first cell holding the header, or None
+        """
+        return self.positions.get(column_name)
+
+    def locate(self, column_name: str) -> Optional[Tuple[int, int]]:
+        """
+        Find a column header anywhere in the sheet.
+
+        The header rows are searched first, then the rest of the sheet row
+        by row; the outcome of the full scan is cached.
+
+        Returns:
+            (row, column) of the first cell holding the header, or None
+        """
+        position = self.positions.get(column_name)
+        if position is not None:
+            return position
+        if column_name not in self._located:
+            self._located[column_name] = None
+            min_row = len(self.header_values) + 1
+            rows = self.sheet.iter_rows(min_row=min_row, max_row=self.sheet.max_row, values_only=True)
+            for row_idx, row in enumerate(rows, min_row):
+                if column_name in row:
+                    self._located[column_name] = (row_idx, row.index(column_name) + 1)
+                    break
+        return self._located[column_name]
+
+    def header_row(self, required_columns: List[str]) -> Optional[int]:
+        """
+        Find the first header row holding all the required columns.
+
+        Returns:
+            Row number of the header, or None if not found
+        """
+        for row_idx, row in enumerate(self.header_values, 1):
+            if all(column in row for column in required_columns):
+                return row_idx
+        return None
+
+    def columns(self, header_row: int) -> Dict[Any, int]:
+        """Column index of each non-empty header of a header row."""
+        if header_row not in self._columns:
+            row = self.header_values[header_row - 1] if header_row <= len(self.header_values) else ()
+            self._columns[header_row] = {
+                value: col_idx for col_idx, value in enumerate(row, 1) if value
+            }
+        return self._columns[header_row]
+
+    def column_values(self, column: int, min_row: int) -> List[Any]:
+        """Values of a column from `min_row` to the last row of the sheet."""
+        if hasattr(self.sheet, "column_values"):
+            return self.sheet.column_values(column, min_row)
+        return [
+            row[0]
+            for row in self.sheet.iter_rows(
+                min_col=column, max_col=column, min_row=min_row, max_row=self.sheet.max_row, values_only=True
+            )
+        ]
+
+    def row_values(self, row: int, columns: Dict[Any, int]) -> Dict[Any, Any]:
+        """Values of a row for the given columns, by column name."""
+        return {name: self.sheet.cell(row=row, column=col_idx).value for name, col_idx in columns.items()}
+
+
+_tables: "weakref.WeakKeyDictionary[Any, SheetTable]" = weakref.WeakKeyDictionary()
+
+
+def get_sheet_table(sheet) -> SheetTable:
+    """
+    Get the SheetTable of a worksheet, built on first use and kept as long as the sheet.
+
+    Args:
+        sheet: openpyxl Worksheet or ValuesWorksheet
+
+    Returns:
+        SheetTable: Table shared by every reader of the sheet
+    """
+    table = _tables.get(sheet)
+    if table is None:
+        table = _tables[sheet] = SheetTable(sheet)
+    return table
+
+
+def discard_sheet_table(sheet):
+    """Drop the table of a worksheet whose header rows were rewritten."""
+    _tables.pop(sheet, None)
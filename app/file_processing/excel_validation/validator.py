@@ -1,10 +1,22 @@
 import re
-from typing import Callable, Set, Dict, Any, Optional, Tuple
-from openpyxl import Workbook, load_workbook
+from typing import BinaryIO, Callable, List, Set, Dict, Any, Optional, Tuple, Union
+import pandas as pd
+from openpyxl import Workbook
 from openpyxl.cell import Cell
 from openpyxl.comments import Comment
-from openpyxl.styles import Alignment, PatternFill
 from openpyxl.worksheet.worksheet import Worksheet
+from app.core.config import settings
+from app.file_processing.excel_validation.annotations import (
+    COMMENT_AUTHOR, COMMENT_SEPARATOR, LEFT_ALIGNMENT, NO_FILL, CellAnnotations, solid_fill, styled_rows,
+    unique_messages,
+)
+from app.file_processing.excel_validation.document import ParsedDocument
+from app.file_processing.excel_validation.error_report import ValidationErrorReport
+from app.file_processing.excel_validation.lazy_workbook import LazyWorkbook
+from app.file_processing.excel_validation.loader import MOTHER_PARKERS_REQUIRED_SHEETS
+from app.file_processing.excel_validation.row_errors import RowErrors
+from app.file_processing.excel_validation.rules import CompiledRule, ReferenceSet, ValidationRule
+from app.file_processing.excel_validation.sheet_table import discard_sheet_table, get_sheet_table
 from app.utils.logger import logger
 import io
 
@@ -12,8 +24,6 @@ import io
 VENDOR_NOT_FOUND = "Vendor not found"
 ENTITY_NOT_FOUND = "Entity not found at Database"
 CONTAINER_NOT_FOUND = "Container number not found"
-COMMENT_AUTHOR = "COSA Validation System"
-COMMENT_SEPARATOR = ", "
 
 def simple_slugify(text):
     """Convert text to a simple slug format (lowercase, hyphenated)"""
@@ -30,6 +40,55 @@ def normalize_container_number(number):
     # Normalize by removing spaces and converting to uppercase
     return re.sub(r'\s', '', str(number).upper())
 
+def normalize_container_cell(value):
+    """Normalize a Manual Sheet container cell, whose text is compared as str(value)"""
+    return normalize_container_number(str(value))
+
+def as_text_series(values: List[Any], none_value: str) -> pd.Series:
+    """Column values as a Series of Python strings, None being replaced by none_value"""
+    return pd.Series(values, dtype=object).fillna(none_value).astype(str).astype(object)
+
+def slugify_series(values: List[Any]) -> pd.Series:
+    """Vectorized simple_slugify of column values"""
+    text = as_text_series(values, "").str.lower()
+    text = text.str.replace(r'[^\w\s-]', '', regex=True)
+    return text.str.replace(r'[-\s]+', '-', regex=True).str.strip('-_')
+
+def normalize_container_series(values: List[Any]) -> pd.Series:
+    """Vectorized normalize_container_number(str(value)) of column values"""
+    return as_text_series(values, "None").str.upper().str.replace(r'\s', '', regex=True)
+
+# Vectorized counterpart of each rule normalizer
+SERIES_NORMALIZERS = {
+    simple_slugify: slugify_series,
+    normalize_container_cell: normalize_container_series,
+}
+
+VENDORS = ReferenceSet("vendors", ["Single Supplier Table"], "Company Name", simple_slugify)
+CONTAINERS = ReferenceSet(
+    "containers", ["Worksheet- Coffee", "Worksheet- Tea"], "Container #", normalize_container_number
+)
+ENTITIES = ReferenceSet(
+    "entities", ["Database - Others", "Database-RA+FT Coop"], "Company Name", simple_slugify
+)
+
+# Manual Sheet rules, applied to each cell in this order
+MANUAL_SHEET_RULES = [
+    ValidationRule("vendor", "Exporter Name", simple_slugify, VENDORS, VENDOR_NOT_FOUND, "vendor_not_found"),
+    ValidationRule(
+        "container", "Container Number", normalize_container_cell, CONTAINERS, CONTAINER_NOT_FOUND,
+        "container_not_found", log_failures=False,
+    ),
+    ValidationRule(
+        "entity_exporter", "Exporter Name", simple_slugify, ENTITIES, ENTITY_NOT_FOUND,
+        "entity_not_found", counts_as_multiple_error=True,
+    ),
+    ValidationRule(
+        "entity_mill", "Mill Name", simple_slugify, ENTITIES, ENTITY_NOT_FOUND,
+        "entity_not_found", counts_as_multiple_error=True,
+    ),
+]
+
 class ValidationStats:
     """Tracks validation statistics and errors"""
     def __init__(self):
@@ -47,30 +106,57 @@ class ExcelValidator:
     
     def __init__(self):
         self.stats = ValidationStats()
+        self.annotations = CellAnnotations()
+        self.errors = ValidationErrorReport()
+        # Per-row error bitmap, and source row of each row of the expanded Manual Sheet
+        self.row_errors: Optional[RowErrors] = None
+        self.source_rows: Optional[List[int]] = None
     
-    def validate_workbook_bytes(self, file_content: bytes) -> Tuple[bytes, Dict[str, Any], Workbook]:
+    def validate_workbook_bytes(self, file_content: Union[bytes, BinaryIO]) -> Tuple[Any, Dict[str, Any], Workbook]:
         """
         Validate Excel workbook from bytes content
         
         Args:
-            file_content: Bytes content of the Excel file
+            file_content: Bytes content of the Excel file, or the file itself
             
         Returns:
             Tuple containing:
-            - The processed workbook as bytes
+            - The processed workbook as bytes (the unchanged input if the
+              workbook is not in the expected format)
             - Validation report dictionary
             - Original workbook object for database processing
         """
-        # Load workbook from bytes
-        wb = load_workbook(io.BytesIO(file_content))
+        if isinstance(file_content, bytes):
+            file_content = io.BytesIO(file_content)
+        return self.validate_document(ParsedDocument(file_content))
+
+    def validate_document(
+        self, document: ParsedDocument, write_output: bool = True
+    ) -> Tuple[Any, Dict[str, Any], Workbook]:
+        """
+        Validate the workbook of a parsed document, reusing its parsed workbook
+        
+        Args:
+            document: Parsed document shared with the other processing stages
+            write_output: Whether to save the annotated workbook, otherwise
+                None is returned in its place and save_workbook can be
+                called later
+            
+        Returns:
+            Same as validate_workbook_bytes
+        """
+        file_content = document.file
+        wb = document.workbook
         logger.info(f"Excel file loaded. Available sheets: {wb.sheetnames}")
         
         # Reset statistics
         self.stats = ValidationStats()
+        self.errors = ValidationErrorReport()
+        self.row_errors = None
+        self.source_rows = None
         
         # Check if this is the expected Mother Parkers format
-        required_sheets = ["Manual Sheet", "Single Supplier Table", "Worksheet- Coffee", "Worksheet- Tea"]
-        for sheet in required_sheets:
+        for sheet in MOTHER_PARKERS_REQUIRED_SHEETS:
             if sheet not in wb.sheetnames:
                 logger.warning(f"Required sheet '{sheet}' not found. This may not be a Mother Parkers Excel file.")
                 return file_content, {"error": f"Required sheet '{sheet}' not found"}, wb
@@ -80,11 +166,23 @@ class ExcelValidator:
         self.stats.total_rows = manual_sheet.max_row - 1  # Exclude header
         
         # Run validations
-        wb = self.validate_vendor(wb)
-        wb = self.validate_container_number(wb)
-        wb = self.validate_entities(wb)
+        if settings.validation_engine == "rules":
+            wb = self.validate_rules(wb)
+        elif settings.validation_engine == "vectorized":
+            wb = self.validate_vectorized(wb)
+        else:
+            wb = self.validate_vendor(wb)
+            wb = self.validate_container_number(wb)
+            wb = self.validate_entities(wb)
         wb = self.create_manual_sheet_entries(wb)
         
+        # Row validity for the DB stage, looked up by row of the expanded sheet
+        if self.row_errors is None:
+            self.row_errors = RowErrors.from_report(
+                self.errors, [rule.name for rule in MANUAL_SHEET_RULES], self.stats.total_rows + 1
+            )
+        self.row_errors.set_source_rows(self.source_rows)
+        
         # Calculate valid rows
         self.stats.valid_rows = self.stats.total_rows - len(self.stats.error_rows)
         self.stats.invalid_rows = len(self.stats.error_rows)
@@ -92,12 +190,16 @@ class ExcelValidator:
         # Generate report
         report = self.generate_validation_report()
         
-        # Save workbook to bytes
+        if not write_output:
+            return None, report, wb
+        return self.save_workbook(wb), report, wb
+
+    def save_workbook(self, wb: Workbook) -> bytes:
+        """Save the annotated workbook to bytes"""
         output = io.BytesIO()
         wb.save(output)
         output.seek(0)
-        
-        return output.getvalue(), report, wb
+        return output.getvalue()
 
     def validate_vendor(self, wb: Workbook) -> Workbook:
         """Validate vendor names against Single Supplier Table"""
@@ -133,6 +235,9 @@ class ExcelValidator:
                 cell = row[0]
                 if simple_slugify(cell.value) not in company_names:
                     logger.info(f"Vendor not found: {cell.value}")
+                    self.errors.add(
+                        cell.row, column_name, "vendor", VENDOR_NOT_FOUND, cell.value, simple_slugify(cell.value)
+                    )
                     cell = self.mark_cell(cell, cell_comment=VENDOR_NOT_FOUND)
                     self.stats.vendor_not_found += 1
                     self.stats.error_rows.add(cell.row)
@@ -179,6 +284,10 @@ class ExcelValidator:
                 normalized_value = normalize_container_number(str(cell.value))
                 if normalized_value not in container_numbers:
                     not_found_containers.add(cell.value)
+                    self.errors.add(
+                        cell.row, manual_sheet_column_name, "container", CONTAINER_NOT_FOUND,
+                        cell.value, normalized_value,
+                    )
                     cell = self.mark_cell(cell, cell_comment=CONTAINER_NOT_FOUND)
                     self.stats.container_not_found += 1
                     self.stats.error_rows.add(cell.row)
@@ -212,8 +321,9 @@ class ExcelValidator:
         logger.info(f"Company names found - Others: {len(company_names_db_other)}, Coop: {len(company_names_db_coop)}")
 
         manual_sheet_ws = wb["Manual Sheet"]
-        target_columns = ["Exporter Name", "Mill Name"]
-        for target_column in target_columns:
+        # Target columns and the name of their check in the error report
+        target_columns = {"Exporter Name": "entity_exporter", "Mill Name": "entity_mill"}
+        for target_column, rule_name in target_columns.items():
             logger.info(
                 f"Verifying '{target_column}' values against 'Company Name' in database sheets..."
             )
@@ -237,6 +347,9 @@ class ExcelValidator:
                         and slugified_value not in company_names_db_other
                     ):
                         logger.info(f"Entity not found: {cell.value}")
+                        self.errors.add(
+                            cell.row, target_column, rule_name, ENTITY_NOT_FOUND, cell.value, slugified_value
+                        )
                         cell = self.mark_cell(cell, cell_comment=ENTITY_NOT_FOUND)
                         self.stats.entity_not_found += 1
                         self.stats.error_rows.add(cell.row)
@@ -248,48 +361,188 @@ class ExcelValidator:
         logger.info("Entity validation completed.")
         return wb
 
+    def compile_rules(self, wb: Workbook, rules: List[ValidationRule]) -> List[CompiledRule]:
+        """
+        Bind rules to their Manual Sheet column and reference values.
+
+        Each reference set is loaded once, however many rules use it. Rules
+        whose reference set is empty or whose column is missing are skipped.
+        """
+        manual_table = get_sheet_table(wb["Manual Sheet"])
+        references: Dict[str, Set[str]] = {}
+        compiled = []
+        for rule in rules:
+            reference = rule.reference
+            if reference.name not in references:
+                values = set()
+                for sheet_name in reference.sheets:
+                    values.update(self.get_column_values(wb[sheet_name], reference.column, reference.normalizer))
+                logger.info(f"Reference values found - {reference.name}: {len(values)}")
+                references[reference.name] = values
+
+            if not references[reference.name]:
+                logger.warning(f"No {reference.name} found, skipping '{rule.name}' validation")
+                continue
+            position = manual_table.locate(rule.column)
+            if position is None:
+                logger.warning(f"Column '{rule.column}' not found in 'Manual Sheet'")
+                continue
+            compiled.append(CompiledRule(rule, position[0], position[1], references[reference.name]))
+        return compiled
+
+    def apply_rule(self, compiled: CompiledRule, cell: Cell, failed: bool, normalized: Any = None):
+        """Queue the annotation of a cell with the outcome of a rule and record failures in the stats and error report"""
+        rule = compiled.rule
+        if not failed:
+            self.annotations.clear(cell, rule.message)
+            return
+
+        if rule.log_failures:
+            logger.info(f"{rule.message}: {cell.value}")
+        self.annotations.mark(cell, rule.message)
+        self.errors.add(cell.row, rule.column, rule.name, rule.message, cell.value, normalized)
+        setattr(self.stats, rule.stat, getattr(self.stats, rule.stat) + 1)
+        self.stats.error_rows.add(cell.row)
+        if rule.counts_as_multiple_error:
+            self.stats.multiple_errors.add(cell.row)
+        compiled.not_found.add(cell.value)
+
+    def validate_rules(self, wb: Workbook, rules: List[ValidationRule] = MANUAL_SHEET_RULES) -> Workbook:
+        """
+        Run declarative rules on the Manual Sheet in a single pass over its rows.
+
+        Each cell is normalized once per normalizer and checked by every rule
+        on its column, in rule order, so annotations and stats are the same
+        as running validate_vendor, validate_container_number and
+        validate_entities in sequence.
+        """
+        logger.info("Starting rule validation...")
+        manual_sheet_ws = wb["Manual Sheet"]
+        self.annotations = CellAnnotations()
+        compiled = self.compile_rules(wb, rules)
+        if not compiled:
+            return wb
+
+        for row in range(min(rule.header_row for rule in compiled) + 1, manual_sheet_ws.max_row + 1):
+            normalized = {}
+            for rule in compiled:
+                if row <= rule.header_row:
+                    continue
+                cell = manual_sheet_ws.cell(row=row, column=rule.column)
+                key = (rule.column, rule.rule.normalizer)
+                if key not in normalized:
+                    normalized[key] = rule.rule.normalizer(cell.value)
+                self.apply_rule(rule, cell, normalized[key] not in rule.reference_values, normalized[key])
+
+        for rule in compiled:
+            logger.info(f"'{rule.rule.name}' validation: {len(rule.not_found)} distinct values not found")
+        logger.info(f"Rule validation completed, {self.annotations.apply()} cells annotated.")
+        return wb
+
+    def validate_vectorized(self, wb: Workbook, rules: List[ValidationRule] = MANUAL_SHEET_RULES) -> Workbook:
+        """
+        Run declarative rules on the Manual Sheet column-wise.
+
+        Each Manual Sheet column is read once and normalized once per
+        normalizer with pandas string operations (or Series.map for
+        normalizers without a vectorized counterpart), then checked in bulk
+        with `isin`, giving a row x rule error mask that becomes row_errors.
+        Failing cells are annotated, and passing cells only when they have a
+        comment or fill to clear; results are the same as validate_rules.
+        """
+        logger.info("Starting vectorized validation...")
+        manual_sheet_ws = wb["Manual Sheet"]
+        self.annotations = CellAnnotations()
+        manual_table = get_sheet_table(manual_sheet_ws)
+
+        # Failing rows of each rule, indexed by row number
+        failures: Dict[str, pd.Series] = {}
+        normalized: Dict[Tuple[int, Callable], pd.Series] = {}
+        # Rows of each column with a comment or fill, the passing cells to clear
+        styled: Dict[int, List[int]] = {}
+        for compiled in self.compile_rules(wb, rules):
+            rule = compiled.rule
+            key = (compiled.column, rule.normalizer)
+            if key not in normalized:
+                values = manual_table.column_values(compiled.column, compiled.header_row + 1)
+                series_normalizer = SERIES_NORMALIZERS.get(rule.normalizer)
+                if series_normalizer is not None:
+                    normalized[key] = series_normalizer(values)
+                else:
+                    normalized[key] = pd.Series(values, dtype=object).map(rule.normalizer)
+                normalized[key].index = pd.RangeIndex(
+                    compiled.header_row + 1, compiled.header_row + 1 + len(values)
+                )
+            failed = ~normalized[key].isin(compiled.reference_values)
+
+            for row in failed.index[failed]:
+                self.apply_rule(
+                    compiled, manual_sheet_ws.cell(row=row, column=compiled.column), True, normalized[key][row]
+                )
+            if compiled.column not in styled:
+                styled[compiled.column] = styled_rows(manual_sheet_ws, compiled.column, 1)
+            for row in styled[compiled.column]:
+                if row in failed.index and not failed[row]:
+                    self.apply_rule(compiled, manual_sheet_ws.cell(row=row, column=compiled.column), False)
+
+            logger.info(f"'{rule.name}' validation: {len(compiled.not_found)} distinct values not found")
+            failures[rule.name] = failed.rename(rule.name)
+
+        if failures:
+            # row x rule error mask, read by the DB stage through row_errors
+            errors = pd.concat(failures.values(), axis=1).astype("boolean").fillna(False).astype(bool)
+            logger.info(f"Rows with errors: {int(errors.any(axis=1).sum())} of {len(errors)}")
+            self.row_errors = RowErrors.from_mask(
+                errors, [rule.name for rule in rules], manual_sheet_ws.max_row
+            )
+
+        logger.info(f"Vectorized validation completed, {self.annotations.apply()} cells annotated.")
+        return wb
+
     def create_manual_sheet_entries(self, wb: Workbook) -> Workbook:
         """Expands rows in the Manual Sheet based on comma-separated values in Coop ID column"""
         sheet_name = "Manual Sheet"
         column_name = "Coop ID"
         logger.info(f"Creating new rows in '{sheet_name}' based on '{column_name}'...")
         ws = wb[sheet_name]
-        new_rows = []
 
         # Find the column index
-        column_index = None
-        for col_index, col_cells in enumerate(ws.iter_cols(1, ws.max_column), start=1):
-            for col_cell in col_cells:
-                if col_cell.value == column_name:
-                    column_index = col_index
-                    break
+        position = get_sheet_table(ws).locate(column_name)
+        column_index = position[1] if position else None
+
+        # (source row, values) of each row of the expanded sheet
+        new_rows = []
 
         # Process each row
-        for row in ws.iter_rows(values_only=True):
+        for source_row, row in enumerate(ws.iter_rows(values_only=True), start=1):
             # Check if the "Coop ID" column contains a comma
             if column_index and row[column_index - 1] and "," in str(row[column_index - 1]):
                 # Split the values in the "Coop ID" column
                 values = row[column_index - 1].split(",")
-                # Keep the first value as the original row's "Coop ID"
-                new_rows.append(list(row))
-                new_rows[-1][column_index - 1] = values[0].strip()
-                # Create new rows for the remaining values
-                for value in values[1:]:
-                    # Copy all columns except the specified column
+                # Create one row per value, all columns except the specified one are copied
+                for value in values:
                     new_row = list(row)
-                    # Update the "Coop ID" in the new row
                     new_row[column_index - 1] = value.strip()
-                    new_rows.append(new_row)
+                    new_rows.append((source_row, new_row))
             else:
                 # If no comma is found, append the original row as is
-                new_rows.append(list(row))
+                new_rows.append((source_row, list(row)))
+        self.source_rows = [source_row for source_row, _ in new_rows]
+
+        if isinstance(wb, LazyWorkbook):
+            # Streamed on save, with the annotations of each source row
+            wb.expand_sheet(sheet_name, new_rows)
+            return wb
 
         # Add the expanded rows to the sheet
-        for i, row in enumerate(new_rows):
+        for i, (_, row) in enumerate(new_rows):
             for j, cell_value in enumerate(row):
-                ws.cell(row=i + 1, column=j + 1).value = cell_value
-                ws.cell(row=i + 1, column=j + 1).alignment = Alignment(horizontal="left")
+                cell = ws.cell(row=i + 1, column=j + 1)
+                cell.value = cell_value
+                cell.alignment = LEFT_ALIGNMENT
 
+        # Rows were rewritten, the header index must be rebuilt on next use
+        discard_sheet_table(ws)
         return wb
 
     def generate_validation_report(self) -> Dict[str, Any]:
@@ -321,14 +574,14 @@ class ExcelValidator:
     def mark_cell(self, cell: Cell, cell_comment: str, color: str = "FF0000") -> Cell:
         """Mark a cell with provided color and comment"""
         # Fill the cell with provided color
-        cell.fill = PatternFill(start_color=color, end_color=color, fill_type="solid")
+        cell.fill = solid_fill(color)
 
         # First check if there is any comment already added
         if cell.comment is not None:
             comments = cell.comment.text.split(COMMENT_SEPARATOR)
             comments.append(cell_comment)
             cell.comment = Comment(
-                text=COMMENT_SEPARATOR.join(set(comments)), author=COMMENT_AUTHOR
+                text=COMMENT_SEPARATOR.join(unique_messages(comments)), author=COMMENT_AUTHOR
             )
         else:
             cell.comment = Comment(text=cell_comment, author=COMMENT_AUTHOR)
@@ -339,7 +592,7 @@ class ExcelValidator:
         """Remove a specific comment from a cell"""
         # Check if current cell has any comment
         if cell.comment is None:
-            cell.fill = PatternFill()
+            cell.fill = NO_FILL
             return cell
         else:
             comments = [
@@ -348,41 +601,34 @@ class ExcelValidator:
             # Check if some comment left
             if comments:
                 cell.comment = Comment(
-                    text=COMMENT_SEPARATOR.join(set(comments)), author=COMMENT_AUTHOR
+                    text=COMMENT_SEPARATOR.join(unique_messages(comments)), author=COMMENT_AUTHOR
                 )
             else:
                 cell.comment = None
-                cell.fill = PatternFill()
+                cell.fill = NO_FILL
 
             return cell
 
     def get_column_cell(self, ws: Worksheet, column_name: str) -> Optional[Cell]:
         """Find the cell containing the column header"""
-        for row in ws.iter_rows(min_row=1):
-            for cell in row:
-                if cell.value == column_name:
-                    return cell
-        return None
+        position = get_sheet_table(ws).locate(column_name)
+        if position is None:
+            return None
+        return ws.cell(row=position[0], column=position[1])
 
     def get_column_values(self, ws: Worksheet, column_name: str, 
                          function: Optional[Callable[[str], str]] = None) -> Set[str]:
         """Get all values from a specific column"""
-        cell = self.get_column_cell(ws, column_name)
+        table = get_sheet_table(ws)
+        position = table.locate(column_name)
 
-        if cell is None:
+        if position is None:
             logger.warning(f"Column '{column_name}' not found in sheet '{ws.title}'")
             return set()
 
         values = set()
-        for row in ws.iter_rows(
-            min_col=cell.column,
-            max_col=cell.column,
-            min_row=cell.row + 1,
-            max_row=ws.max_row,
-            values_only=True,
-        ):
-            if row[0]:
-                value = function(row[0]) if function else row[0]
-                values.add(value)
+        for value in table.column_values(position[1], position[0] + 1):
+            if value:
+                values.add(function(value) if function else value)
 
         return values
\ No newline at end of file
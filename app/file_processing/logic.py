@@ -1,9 +1,29 @@
 import os
+import hashlib
 import mimetypes
 import json
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import partial
+from typing import BinaryIO, Callable, List, Optional, Tuple
+from sqlalchemy import or_
+from sqlalchemy.future import select
+from app.core.config import settings
 from app.utils.logger import logger
-from google.cloud import storage
+from app.db.models.file_tasks import FileTasks, ProcessingStatus
+from app.file_processing.excel_validation.document import DocumentContext
+from app.file_processing.excel_validation.error_report import ERROR_REPORT_FORMATS
 from app.file_processing.processors import get_file_processor
+from app.file_processing.storage import get_storage_backend
+
+DOWNLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+# Earlier tasks with the same content checked for reusable outputs, newest first
+DUPLICATE_CANDIDATES = 5
+
+# Shared by all the files being finished, bounds the concurrent storage calls
+finishing_executor = ThreadPoolExecutor(
+    max_workers=settings.finishing_workers, thread_name_prefix="file-finish"
+)
 
 
 def detect_file_type(object_name: str) -> str:
@@ -14,37 +34,153 @@ def detect_file_type(object_name: str) -> str:
     return mime_type or "application/octet-stream"
 
 
-def download_file(bucket_name: str, object_name: str) -> tuple[str, bytes]:
+def download_file(bucket_name: str, object_name: str) -> tuple[str, BinaryIO, str]:
     """
-    Download a file from a GCP bucket and return its contents as a string.
+    Download a file from a GCP bucket, hashing its content while it streams.
+
+    The file is streamed in chunks into a spooled temporary file, kept in
+    memory up to DOWNLOAD_SPOOL_MAX_SIZE bytes and on disk above that.
 
     Args:
         bucket_name (str): Name of the bucket.
         object_name (str): Name of the file in the bucket.
 
     Returns:
-        str: Contents of the file as a string.
+        tuple: MIME type, the file positioned at its start (to be closed by
+        the caller) and SHA-256 hex digest of the contents.
 
     Raises:
         RuntimeError: If file download fails.
     """
+    file_obj = tempfile.SpooledTemporaryFile(max_size=settings.download_spool_max_size)
     try:
-        client = storage.Client()
-        bucket = client.bucket(bucket_name)
-        blob = bucket.blob(object_name)
-        content = blob.download_as_bytes()
+        hasher = hashlib.sha256()
+        with get_storage_backend().open(bucket_name, object_name, DOWNLOAD_CHUNK_SIZE) as stream:
+            for chunk in iter(lambda: stream.read(DOWNLOAD_CHUNK_SIZE), b""):
+                hasher.update(chunk)
+                file_obj.write(chunk)
+        file_obj.seek(0)
+        content_sha256 = hasher.hexdigest()
+
         mime_type = detect_file_type(object_name)
         logger.info(
-            f"Downloaded file: {bucket_name}/{object_name}, MIME type: {mime_type}"
+            f"Downloaded file: {bucket_name}/{object_name}, MIME type: {mime_type}, SHA-256: {content_sha256}"
         )
-        return mime_type, content
+        return mime_type, file_obj, content_sha256
     except Exception as e:
+        file_obj.close()
         logger.error(
             f"Error downloading file from gs://{bucket_name}/{object_name}: {e}"
         )
         raise RuntimeError(f"Error downloading file: {str(e)}") from e
 
 
+def parse_gcs_uri(uri: str) -> Tuple[str, str]:
+    """
+    Split a gs://bucket/path URI into bucket name and object path.
+    """
+    bucket_name, _, object_name = uri.removeprefix("gs://").partition("/")
+    return bucket_name, object_name
+
+
+def copy_file(source_uri: str, bucket_name: str, destination_path: str) -> str:
+    """
+    Copy an object server-side, without its bytes going through this service.
+
+    Args:
+        source_uri (str): gs:// URI of the object to copy.
+        bucket_name (str): Name of the destination bucket.
+        destination_path (str): Path of the copy in the destination bucket.
+
+    Returns:
+        str: GCS path of the copy.
+    """
+    try:
+        source_bucket_name, source_path = parse_gcs_uri(source_uri)
+        get_storage_backend().copy(source_bucket_name, source_path, bucket_name, destination_path)
+        logger.info(f"Copied {source_uri} to gs://{bucket_name}/{destination_path}")
+        return f"gs://{bucket_name}/{destination_path}"
+    except Exception as e:
+        logger.error(f"Error copying {source_uri} to gs://{bucket_name}/{destination_path}: {e}")
+        raise RuntimeError(f"Error copying file: {str(e)}") from e
+
+
+def task_outputs(task: FileTasks) -> List[str]:
+    """gs:// URIs of the stored outputs of a task."""
+    return [
+        uri
+        for uri in (task.processed_output_path, task.validation_report_path, task.error_report_path)
+        if uri
+    ]
+
+
+def find_processed_duplicate(db, content_sha256: str) -> Optional[FileTasks]:
+    """
+    Find an earlier task whose results can be reused for a file with the same content.
+
+    Only tasks whose processing fully succeeded, database stage included,
+    are reused. The newest of them whose outputs still all exist is chosen.
+
+    Args:
+        db: Database session.
+        content_sha256 (str): SHA-256 hex digest of the file contents.
+
+    Returns:
+        FileTasks: The newest reusable task with that content, or None.
+    """
+    result = db.execute(
+        select(FileTasks)
+        .filter(
+            FileTasks.content_sha256 == content_sha256,
+            FileTasks.status == ProcessingStatus.PROCESSED,
+            FileTasks.results_reusable.is_(True),
+            or_(FileTasks.processed_output_path.isnot(None), FileTasks.error_report_path.isnot(None)),
+        )
+        .order_by(FileTasks.created_at.desc(), FileTasks.id.desc())
+        .limit(DUPLICATE_CANDIDATES)
+    )
+    candidates = result.scalars().all()
+    # Detached so they outlive the read transaction, which is not kept open
+    # through the storage checks and the processing of the file
+    for task in candidates:
+        db.expunge(task)
+    db.commit()
+
+    storage_backend = get_storage_backend()
+    for task in candidates:
+        missing = [uri for uri in task_outputs(task) if not storage_backend.exists(*parse_gcs_uri(uri))]
+        if not missing:
+            return task
+        logger.info(f"Outputs of task {task.file_id} are missing ({', '.join(missing)}), not reusing it")
+    return None
+
+
+def reused_outputs(duplicate: FileTasks, bucket_name: str, base_name: str, ext: str) -> Tuple[list, dict]:
+    """
+    Server-side copies of the outputs of an earlier task to the paths of a new file.
+
+    Returns:
+        tuple: (object path, function writing it) of each output, and the
+        processed_output_path, validation_report_path and error_report_path
+        of the new file.
+    """
+    processed_base = base_name.replace("new/", "processed/")
+    paths = {
+        "processed_output_path": processed_base + "_output" + ext if duplicate.processed_output_path else None,
+        "validation_report_path": processed_base + "_validation.json" if duplicate.validation_report_path else None,
+        "error_report_path": (
+            processed_base + "_errors" + os.path.splitext(duplicate.error_report_path)[1]
+            if duplicate.error_report_path else None
+        ),
+    }
+    outputs = [
+        (paths[field], partial(copy_file, getattr(duplicate, field), bucket_name, paths[field]))
+        for field in paths
+        if paths[field]
+    ]
+    return outputs, paths
+
+
 def move_file(bucket_name: str, source_path: str, destination_path: str):
     """
     Move a file within a GCP bucket from one path to another.
@@ -58,17 +194,14 @@ def move_file(bucket_name: str, source_path: str, destination_path: str):
         None
     """
     try:
-        # Initialize GCP Storage client
-        client = storage.Client()
-        bucket = client.bucket(bucket_name)
-        source_blob = bucket.blob(source_path)
+        storage_backend = get_storage_backend()
 
         # Copy the file to the new location
-        bucket.copy_blob(source_blob, bucket, destination_path)
+        storage_backend.copy(bucket_name, source_path, bucket_name, destination_path)
         logger.info(f"Copied file from {source_path} to {destination_path}")
 
         # Delete the original file
-        source_blob.delete()
+        storage_backend.delete(bucket_name, source_path)
         logger.info(f"Deleted original file: {source_path}")
     except Exception as e:
         logger.error(
@@ -77,14 +210,14 @@ def move_file(bucket_name: str, source_path: str, destination_path: str):
         raise
 
 
-def upload_output_file(bucket_name: str, object_name: str, content: bytes, content_type=None):
+def upload_output_file(bucket_name: str, object_name: str, content, content_type=None):
     """
     Upload a file to a GCP bucket.
 
     Args:
         bucket_name (str): Name of the bucket.
         object_name (str): Destination file name in the bucket.
-        content (bytes or str): Content of the file to upload.
+        content (bytes, str or file-like): Content of the file to upload.
         content_type (str, optional): Content type of the file.
 
     Returns:
@@ -94,21 +227,13 @@ def upload_output_file(bucket_name: str, object_name: str, content: bytes, conte
         RuntimeError: If file upload fails.
     """
     try:
-        client = storage.Client()
-        bucket = client.bucket(bucket_name)
-        blob = bucket.blob(object_name)
-
         logger.info(f"Uploading file to gs://{bucket_name}/{object_name}")
         
         # Determine content type if not provided
         if content_type is None:
             content_type = detect_file_type(object_name)
         
-        # Handle string vs bytes content
-        if isinstance(content, str):
-            blob.upload_from_string(content, content_type=content_type)
-        else:
-            blob.upload_from_string(content, content_type=content_type)
+        get_storage_backend().upload(bucket_name, object_name, content, content_type)
             
         return f"gs://{bucket_name}/{object_name}"
     except Exception as e:
@@ -116,67 +241,236 @@ def upload_output_file(bucket_name: str, object_name: str, content: bytes, conte
         raise RuntimeError(f"Error uploading file: {str(e)}") from e
 
 
-def process_file_logic(bucket_name: str, object_name: str, db):
+def upload_generated_file(bucket_name: str, object_name: str, generate: Callable[[], object], content_type=None):
+    """
+    Generate the content of an output file and upload it.
+
+    Used for outputs that are only produced when they are written, such as
+    the annotated workbook. File-like content is closed once uploaded.
+
+    Args:
+        bucket_name (str): Name of the bucket.
+        object_name (str): Destination file name in the bucket.
+        generate (callable): Returns the content (bytes, str or file-like).
+        content_type (str, optional): Content type of the file.
+
+    Returns:
+        str: GCS path of the uploaded file.
+    """
+    content = generate()
+    try:
+        return upload_output_file(bucket_name, object_name, content, content_type)
+    finally:
+        if hasattr(content, "close"):
+            content.close()
+
+
+def finish_processing(
+    bucket_name: str,
+    object_name: str,
+    processed_path: str,
+    outputs: List[Tuple[str, Callable[[], object]]],
+):
+    """
+    Write the outputs of a processed file and move the file to its processed path.
+
+    The outputs and the copy of the original run concurrently, so the stage
+    takes as long as the slowest of them. It is all-or-nothing: the original
+    is only deleted once every write succeeded, otherwise the objects that
+    were written are deleted again and the original is left untouched.
+
+    Args:
+        bucket_name (str): Name of the bucket.
+        object_name (str): Path of the original file in the bucket.
+        processed_path (str): Path the original file is moved to.
+        outputs (list): (object path, function writing it) of each output.
+
+    Raises:
+        RuntimeError: If any of the writes fails.
+    """
+    storage_backend = get_storage_backend()
+    steps = outputs + [
+        (
+            processed_path,
+            partial(storage_backend.copy, bucket_name, object_name, bucket_name, processed_path),
+        )
+    ]
+    futures = {finishing_executor.submit(write): path for path, write in steps}
+    wait(futures)
+
+    failed = [(path, future.exception()) for future, path in futures.items() if future.exception()]
+    if failed:
+        for future, path in futures.items():
+            if future.exception() is None:
+                try:
+                    storage_backend.delete(bucket_name, path)
+                except Exception as e:
+                    logger.error(f"Failed to roll back gs://{bucket_name}/{path}: {e}")
+        errors = "; ".join(f"{path}: {error}" for path, error in failed)
+        raise RuntimeError(f"Error writing processed outputs: {errors}")
+
+    logger.info(f"Copied file from {object_name} to {processed_path}")
+    storage_backend.delete(bucket_name, object_name)
+    logger.info(f"Deleted original file: {object_name}")
+
+
+def process_file_logic(bucket_name: str, object_name: str, db, progress=None, before_finish=None):
     """
     Core logic to process a file from a GCP bucket.
 
+    Files whose content was already processed successfully by an earlier
+    task are not processed again: the earlier processed output, validation
+    report and error report are copied server-side to the paths of the new
+    file. When that copy fails the file is processed normally.
+
     Args:
         bucket_name (str): Name of the bucket.
         object_name (str): File path in the bucket.
         db: Database session.
+        progress (callable, optional): Called as progress(stage, current, total)
+            when the processing reaches a new stage.
+        before_finish (callable, optional): Called right before the outputs
+            are written; raising from it aborts the processing with the
+            original file left in place.
 
     Returns:
         dict: Details of the processing.
     """
+    if progress is None:
+        progress = lambda stage, current=None, total=None: None
+
+    file_obj = None
+    # Parsed forms of the file, shared by the processor selection and processing
+    documents = DocumentContext()
     try:
         # Download the file
-        mime_type, file_content = download_file(bucket_name, object_name)
-
-        # Determine the appropriate processor based on file type
-        processor = get_file_processor(mime_type, object_name, file_content)
-        
-        # Set bucket info in processor context (for Mother Parkers processor)
-        if hasattr(processor, 'context'):
-            processor.context['bucket_name'] = bucket_name
-            processor.context['file_path'] = object_name
-
-        # Process the file and get the processed output
-        processed_content = processor.process(file_content)
-        logger.info(f"Processed file {object_name} successfully")
+        mime_type, file_obj, content_sha256 = download_file(bucket_name, object_name)
+        progress("downloaded")
 
         # Prepare the processed path with `_output` appended
         base_name, ext = os.path.splitext(object_name)
-        processed_path = base_name.replace("new/", "processed/") + ext
         processed_output_path = (
             base_name.replace("new/", "processed/") + "_output" + ext
         )
-        
-        # For Mother Parkers files, also store validation report
         validation_report_path = None
-        if hasattr(processor, 'validation_report') and processor.validation_report:
-            validation_report_path = base_name.replace("new/", "processed/") + "_validation.json"
-            report_json = json.dumps(processor.validation_report, indent=2)
-            upload_output_file(bucket_name, validation_report_path, report_json, "application/json")
-            logger.info(f"Uploaded validation report to gs://{bucket_name}/{validation_report_path}")
+        error_report_path = None
+        processed_path = object_name.replace("new/", "processed/", 1)
 
-        # Upload processed output
-        upload_output_file(bucket_name, processed_output_path, processed_content)
+        duplicate = find_processed_duplicate(db, content_sha256)
+        if duplicate:
+            logger.info(
+                f"File {object_name} has the same content as task {duplicate.file_id}, reusing its results"
+            )
+            outputs, paths = reused_outputs(duplicate, bucket_name, base_name, ext)
+            if before_finish:
+                before_finish()
+            try:
+                finish_processing(bucket_name, object_name, processed_path, outputs)
+                processed_output_path = paths["processed_output_path"]
+                validation_report_path = paths["validation_report_path"]
+                error_report_path = paths["error_report_path"]
+                processors = duplicate.processors
+                results_reusable = True
+            except RuntimeError as e:
+                logger.warning(f"Could not reuse the results of task {duplicate.file_id}, processing {object_name}: {e}")
+                duplicate = None
 
-        # Move the original file from /new to /processed
-        processed_path = object_name.replace("new/", "processed/", 1)
-        move_file(bucket_name, object_name, processed_path)
+        if not duplicate:
+            # (object path, function writing it) of the outputs of the file
+            outputs = []
+            # Determine the appropriate processor based on file type
+            document = documents.get(file_obj, content_sha256)
+            processor = get_file_processor(mime_type, object_name, file_obj, document)
+
+            # Set bucket info in processor context (for Mother Parkers processor)
+            if hasattr(processor, 'context'):
+                processor.context['bucket_name'] = bucket_name
+                processor.context['file_path'] = object_name
+                processor.context['progress'] = progress
+                processor.context['content_sha256'] = content_sha256
+
+            if processor.passthrough:
+                # Output identical to the input, copy it server-side
+                logger.info(f"Processor output of {object_name} is the original file, copying it")
+                processors = [type(processor).__name__]
+                results_reusable = True
+                outputs.append((
+                    processed_output_path,
+                    partial(copy_file, f"gs://{bucket_name}/{object_name}", bucket_name, processed_output_path),
+                ))
+            else:
+                # Process the file and get the processed output
+                file_obj.seek(0)
+                processed_content = processor.process(file_obj)
+                logger.info(f"Processed file {object_name} successfully")
+                processors = [type(processor).__name__]
+                results_reusable = processor.results_reusable
+
+                # For Mother Parkers files, also store validation report
+                if hasattr(processor, 'validation_report') and processor.validation_report:
+                    validation_report_path = base_name.replace("new/", "processed/") + "_validation.json"
+                    report_json = json.dumps(processor.validation_report, indent=2)
+                    outputs.append((
+                        validation_report_path,
+                        partial(upload_output_file, bucket_name, validation_report_path, report_json, "application/json"),
+                    ))
+
+                # Row-level errors, in the configured format
+                if processor.error_report is not None:
+                    output_format = settings.validation_error_report_format
+                    content_type, suffix = ERROR_REPORT_FORMATS[output_format]
+                    error_report_path = base_name.replace("new/", "processed/") + "_errors" + suffix
+                    outputs.append((
+                        error_report_path,
+                        partial(
+                            upload_generated_file, bucket_name, error_report_path,
+                            partial(processor.error_report.write, output_format), content_type,
+                        ),
+                    ))
+
+                # Upload processed output, generated now if the processor deferred it
+                if processed_content is None:
+                    processed_output_path = None
+                elif callable(processed_content):
+                    outputs.append((
+                        processed_output_path,
+                        partial(upload_generated_file, bucket_name, processed_output_path, processed_content),
+                    ))
+                else:
+                    outputs.append((
+                        processed_output_path,
+                        partial(upload_output_file, bucket_name, processed_output_path, processed_content),
+                    ))
+
+            # Write the outputs and move the original file from /new to /processed
+            if before_finish:
+                before_finish()
+            finish_processing(bucket_name, object_name, processed_path, outputs)
+        progress("uploaded")
 
         result = {
             "status": "processed",
             "processed_path": processed_path,
             "processed_output_path": processed_output_path,
+            "processors": processors,
+            "content_sha256": content_sha256,
+            "results_reusable": results_reusable,
         }
-        
+
         # Add validation report path if available
         if validation_report_path:
             result["validation_report_path"] = validation_report_path
-            
+        if error_report_path:
+            result["error_report_path"] = error_report_path
+
+        if duplicate:
+            result["deduplicated_from"] = duplicate.file_id
+
         return result
     except Exception as e:
         logger.error(f"Failed to process file {object_name}: {e}")
         raise RuntimeError(f"Error processing file: {str(e)}")
+    finally:
+        documents.clear()
+        if file_obj is not None:
+            file_obj.close()
@@ -5,13 +5,14 @@ from datetime import datetime
 from sqlalchemy import create_engine, func
 from sqlalchemy.orm import sessionmaker
 from app.utils.logger import logger
+from app.file_processing.excel_validation.sheet_table import get_sheet_table
 from app.file_processing.mother_parkers.models import (
     Entity, Country, Engagement, SaleTransaction, 
     SaleTransactionParam, EngagementEntity, EntityClient, CosaParam
 )
 
 class DBOperations:
-    def __init__(self, connection_string, use_db=True, single_record_mode=False):
+    def __init__(self, connection_string, use_db=True, single_record_mode=False, progress_callback=None):
         """
         Inicializa las operaciones de base de datos para Mother Parkers.
         
@@ -19,9 +20,12 @@ class DBOperations:
             connection_string: Cadena de conexión a la base de datos
             use_db: Si es True, realiza cambios reales en la BD. Si es False, simula las operaciones.
             single_record_mode: Si es True, procesa solo un registro por tipo.
+            progress_callback: Opcional, se llama como progress_callback(etapa, actual, total)
+                durante el procesamiento de entidades y transacciones.
         """
         self.use_db = use_db
         self.single_record_mode = single_record_mode
+        self.progress_callback = progress_callback
         
         if self.use_db:
             try:
@@ -37,6 +41,15 @@ class DBOperations:
         self.transactions_to_process = 0
         self.transactions_processed = 0
         self.param_mapping = {}  
+        # Índices contenedor normalizado -> fila de las hojas Coffee/Tea,
+        # construidos una sola vez por hoja
+        self.container_indexes = {}
+        self.matching_row_indexes = {}
+
+    def report_progress(self, stage, current, total):
+        """Notifica el avance de una etapa si hay un callback configurado."""
+        if self.progress_callback:
+            self.progress_callback(stage, current, total)
 
     def normalize_container_number(self, number):
         #sin espacios y todo en mayusculas
@@ -53,18 +66,21 @@ class DBOperations:
 
     def find_matching_row(self, container_number, worksheet):
         """Busca una fila con un número de contenedor coincidente en una hoja de trabajo."""
-        normalized_container = self.normalize_container_number(container_number)
-        for row in worksheet.iter_rows(min_row=2, values_only=True):
-            if self.normalize_container_number(row[11]) == normalized_container:  # Column L is index 11
-                return row
-        return None
+        if worksheet not in self.matching_row_indexes:
+            # Primera fila de cada contenedor normalizado
+            index = {}
+            for row in worksheet.iter_rows(min_row=2, values_only=True):
+                index.setdefault(self.normalize_container_number(row[11]), row)  # Column L is index 11
+            self.matching_row_indexes[worksheet] = index
+        return self.matching_row_indexes[worksheet].get(self.normalize_container_number(container_number))
 
-    def process_workbook(self, workbook):
+    def process_workbook(self, workbook, row_errors=None):
         """
         Procesa el libro de Excel completo, extrayendo entidades y transacciones.
         
         Args:
             workbook: Objeto de libro de Excel (Workbook) de openpyxl
+            row_errors: Errores por fila de la validación (RowErrors), opcional
             
         Returns:
             dict: Resultados del procesamiento
@@ -81,7 +97,7 @@ class DBOperations:
             results["entities_processed"] = entities_count
             
             #  transacciones
-            transactions_count = self.process_transactions_from_workbook(workbook)
+            transactions_count = self.process_transactions_from_workbook(workbook, row_errors)
             results["transactions_processed"] = transactions_count
             
             logger.info(f"Procesamiento completo: {entities_count} entidades, {transactions_count} transacciones")
@@ -108,49 +124,44 @@ class DBOperations:
         
         try:
             sheets_to_process = ['Database - Others', 'Database-RA+FT Coop', 'Single Supplier Table']
+            
+            # filas a recorrer, para informar el avance
+            rows_total = sum(
+                max(workbook[name].max_row - 1, 0) for name in sheets_to_process if name in workbook.sheetnames
+            )
+            rows_done = 0
+            self.report_progress("entities", rows_done, rows_total)
+            
             for sheet_name in sheets_to_process:
                 if sheet_name not in workbook.sheetnames:
                     logger.warning(f"La hoja '{sheet_name}' no existe en el workbook")
                     continue
                 
-                sheet = workbook[sheet_name]
-                
-                # Encontrar la fila del encabezado
-                header_row = None
-                company_name_col = None
-                
-                # se busca la columna "Company Name" en las primeras 5 filas
-                for row_idx in range(1, 6):
-                    for col_idx, cell in enumerate(sheet[row_idx], 1):
-                        if cell.value == "Company Name":
-                            header_row = row_idx
-                            company_name_col = col_idx
-                            break
-                    if header_row:
-                        break
+                table = get_sheet_table(workbook[sheet_name])
                 
-                if not header_row:
+                # se busca la columna "Company Name" en las filas de encabezado
+                position = table.find("Company Name")
+                if not position:
                     logger.warning(f"No se encontró la columna 'Company Name' en la hoja '{sheet_name}'")
                     continue
+                header_row, company_name_col = position
                 
                 # mapeo de columnas a sus índices
-                columns = {}
-                for col_idx, cell in enumerate(sheet[header_row], 1):
-                    if cell.value:
-                        columns[cell.value] = col_idx
+                columns = table.columns(header_row)
                 
                 # Procesar las filas de datos
                 entities_processed_in_sheet = 0
-                for row_idx in range(header_row + 1, sheet.max_row + 1):
+                company_names = table.column_values(company_name_col, header_row + 1)
+                for row_idx, company_name in enumerate(company_names, header_row + 1):
+                    rows_done += 1
+                    self.report_progress("entities", rows_done, rows_total)
                     
-                    company_name_cell = sheet.cell(row=row_idx, column=company_name_col)
-                    if not company_name_cell.value:
+                    if not company_name:
                         continue
                     
                     # diccionario con los datos de la entidad
-                    entity_data = {"Company Name": company_name_cell.value}
-                    for column_name, col_idx in columns.items():
-                        entity_data[column_name] = sheet.cell(row=row_idx, column=col_idx).value
+                    entity_data = {"Company Name": company_name}
+                    entity_data.update(table.row_values(row_idx, columns))
                     
                     
                     entity_id = self.create_or_update_entity(entity_data)
@@ -165,6 +176,7 @@ class DBOperations:
                 
                 logger.info(f"Procesadas {entities_processed_in_sheet} entidades de la hoja '{sheet_name}'")
             
+            self.report_progress("entities", rows_total, rows_total)
             logger.info(f"Procesamiento de entidades completado. Total: {processed_count}")
             return processed_count
         except Exception as e:
@@ -248,12 +260,16 @@ class DBOperations:
         finally:
             session.close()
 
-    def process_transactions_from_workbook(self, workbook):
+    def process_transactions_from_workbook(self, workbook, row_errors=None):
         """
         Procesa las transacciones directamente desde un objeto Workbook de openpyxl.
         
+        Con row_errors la validez de cada fila se consulta en el bitmap de
+        errores de la validación; sin él se leen los rellenos rojos de la hoja.
+        
         Args:
             workbook: Objeto de libro Excel (openpyxl.Workbook)
+            row_errors: Errores por fila de la validación (RowErrors), opcional
             
         Returns:
             int: Número de transacciones procesadas
@@ -279,40 +295,40 @@ class DBOperations:
             tea_sheet = workbook["Worksheet- Tea"]
             
             #filas y columnas de encabezado
-            manual_header_row = self.find_header_row(manual_sheet, ["Exporter Name", "Container Number"])
+            manual_table = get_sheet_table(manual_sheet)
+            manual_header_row = manual_table.header_row(["Exporter Name", "Container Number"])
             if not manual_header_row:
                 logger.error("No se encontraron las columnas necesarias en 'Manual Sheet'")
                 return 0
             
             #mapeo de nombres de columna a índices
-            manual_columns = {}
-            for col_idx, cell in enumerate(manual_sheet[manual_header_row], 1):
-                if cell.value:
-                    manual_columns[cell.value] = col_idx
+            manual_columns = manual_table.columns(manual_header_row)
+            exporter_names = manual_table.column_values(manual_columns["Exporter Name"], manual_header_row + 1)
             
             #  número total de transacciones a procesar
             self.transactions_to_process = 0
-            for row_idx in range(manual_header_row + 1, manual_sheet.max_row + 1):
-                exporter_name = manual_sheet.cell(row=row_idx, column=manual_columns.get("Exporter Name", 0)).value
+            for exporter_name in exporter_names:
                 if exporter_name and str(exporter_name).strip():
                     self.transactions_to_process += 2  # Dos transacciones por fila válida
             
             logger.info(f"Se procesarán hasta {self.transactions_to_process} transacciones (2 por fila válida).")
+            self.report_progress("transactions", processed_count, self.transactions_to_process)
             
             # Procesar cada fila en Manual Sheet
-            for row_idx in range(manual_header_row + 1, manual_sheet.max_row + 1):
+            for row_idx, exporter_name in enumerate(exporter_names, manual_header_row + 1):
                 # control: nombre de exportador
-                exporter_name = manual_sheet.cell(row=row_idx, column=manual_columns.get("Exporter Name", 0)).value
                 if not exporter_name or not str(exporter_name).strip():
                     continue
                 
                 # diccionario con los datos de la transacción
-                transaction_data = {}
-                for column_name, col_idx in manual_columns.items():
-                    transaction_data[column_name] = manual_sheet.cell(row=row_idx, column=col_idx).value
+                transaction_data = manual_table.row_values(row_idx, manual_columns)
                 
-                # la fila es válida? (no tiene celdas rojas)
-                if self.is_valid_row(manual_sheet, row_idx):
+                # la fila es válida? (sin errores de validación / sin celdas rojas)
+                if row_errors is not None:
+                    row_is_valid = row_errors.is_valid(row_idx)
+                else:
+                    row_is_valid = self.is_valid_row(manual_sheet, row_idx)
+                if row_is_valid:
                     logger.info(f"Procesando fila {row_idx}: Exportador='{exporter_name}', Contenedor='{transaction_data.get('Container Number')}'")
                     
                     # Primera transacción con datos originales
@@ -355,11 +371,16 @@ class DBOperations:
                     else:
                         logger.warning(f"Fila {row_idx}: Número de contenedor vacío o no válido")
                     
+                    self.report_progress("transactions", processed_count, self.transactions_to_process)
+                    
                     if self.single_record_mode and processed_count > 0:
                         logger.info(f"Modo registro único: Se ha procesado {processed_count} transacción(es)")
                         break
                 else:
-                    logger.info(f"Fila {row_idx} invalidada: Tiene celdas marcadas en rojo")
+                    if row_errors is not None:
+                        logger.info(f"Fila {row_idx} invalidada: {', '.join(row_errors.failed_rules(row_idx))}")
+                    else:
+                        logger.info(f"Fila {row_idx} invalidada: Tiene celdas marcadas en rojo")
             
             logger.info(f"Se procesaron {processed_count} transacciones, de las cuales {self.transactions_processed} se inscribieron en la BD.")
             if self.transactions_processed != processed_count:
@@ -381,20 +402,15 @@ class DBOperations:
         Returns:
             int: Número de fila del encabezado, o None si no se encuentra
         """
-        # Buscar en las primeras 5 filas
-        for row_idx in range(1, 6):
-            col_values = [cell.value for cell in sheet[row_idx]]
-            
-            # Verificar si todas las columnas requeridas están presentes
-            if all(col in col_values for col in required_columns):
-                return row_idx
-                
-        return None
+        # Buscar en las filas de encabezado, indexadas una sola vez por hoja
+        return get_sheet_table(sheet).header_row(required_columns)
 
     def find_matching_container(self, sheet, container_number):
         """
         Busca un número de contenedor en una hoja y devuelve la fila correspondiente.
         
+        La búsqueda usa un índice de la hoja construido en la primera llamada.
+        
         Args:
             sheet: Hoja de trabajo de openpyxl
             container_number: Número de contenedor a buscar
@@ -402,35 +418,51 @@ class DBOperations:
         Returns:
             dict: Datos de la fila encontrada, o None si no se encuentra
         """
-        # Normalizar el número de contenedor de búsqueda
-        normalized_container = self.normalize_container_number(container_number)
+        if sheet not in self.container_indexes:
+            self.container_indexes[sheet] = self.build_container_index(sheet)
+        if self.container_indexes[sheet] is None:
+            return None
+        table, columns, index = self.container_indexes[sheet]
+        
+        # Buscar el número de contenedor normalizado en el índice
+        row_idx = index.get(self.normalize_container_number(container_number))
+        if row_idx is None:
+            return None
+        
+        # Crear un diccionario con los datos de la fila
+        return table.row_values(row_idx, columns)
+
+    def build_container_index(self, sheet):
+        """
+        Construye el índice número de contenedor normalizado -> fila de una hoja.
         
+        Args:
+            sheet: Hoja de trabajo de openpyxl
+            
+        Returns:
+            tuple: (SheetTable, mapeo de columnas, índice con la primera fila de
+            cada contenedor), o None si la hoja no tiene la columna 'Container #'
+        """
         # Encontrar la fila de encabezado y la columna de número de contenedor
-        header_row = self.find_header_row(sheet, ["Container #"])
+        table = get_sheet_table(sheet)
+        header_row = table.header_row(["Container #"])
         if not header_row:
             return None
             
-        # Crear un mapeo de nombres de columna a índices
-        columns = {}
-        for col_idx, cell in enumerate(sheet[header_row], 1):
-            if cell.value:
-                columns[cell.value] = col_idx
+        # Mapeo de nombres de columna a índices
+        columns = table.columns(header_row)
         
         container_col_idx = columns.get("Container #")
         if not container_col_idx:
             return None
             
-        # Buscar en todas las filas
-        for row_idx in range(header_row + 1, sheet.max_row + 1):
-            cell_value = sheet.cell(row=row_idx, column=container_col_idx).value
-            if cell_value and self.normalize_container_number(cell_value) == normalized_container:
-                # Crear un diccionario con los datos de la fila
-                row_data = {}
-                for column_name, col_idx in columns.items():
-                    row_data[column_name] = sheet.cell(row=row_idx, column=col_idx).value
-                return row_data
-                
-        return None
+        # Recorrer todas las filas una sola vez
+        index = {}
+        for row_idx, cell_value in enumerate(table.column_values(container_col_idx, header_row + 1), header_row + 1):
+            if cell_value:
+                index.setdefault(self.normalize_container_number(cell_value), row_idx)
+        logger.info(f"Índice de contenedores de '{sheet.title}': {len(index)} contenedores")
+        return table, columns, index
 
     def is_valid_row(self, sheet, row_idx):
         """
@@ -1,23 +1,75 @@
+import codecs
 from abc import ABC, abstractmethod
+from typing import BinaryIO, Optional
 from app.utils.logger import logger
-from app.file_processing.excel_validation.loader import is_excel_file, is_mother_parkers_format
+from app.file_processing.excel_validation.loader import (
+    has_mother_parkers_sheets, is_excel_file, read_sheet_names
+)
 
-def get_file_processor(mime_type: str, file_name: str, file_content: bytes):
+CHUNK_SIZE = 1024 * 1024
+SNIFF_SIZE = 4096
+
+XLSX_MIME_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+ZIP_MAGIC = b"PK\x03\x04"
+OLE2_MAGIC = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"  # Legacy .xls and other OLE2 documents
+
+
+def sniff_mime_type(file_content: BinaryIO) -> Optional[str]:
+    """
+    Guess the MIME type of a file from its first bytes.
+
+    Args:
+        file_content (BinaryIO): The content of the file, as a seekable binary file.
+
+    Returns:
+        str: The guessed MIME type, or None if the content is not recognized.
+    """
+    file_content.seek(0)
+    head = file_content.read(SNIFF_SIZE)
+    file_content.seek(0)
+
+    if head.startswith(ZIP_MAGIC):
+        return XLSX_MIME_TYPE
+    if head.startswith(OLE2_MAGIC):
+        return "application/vnd.ms-excel"
+
+    text = head.removeprefix(codecs.BOM_UTF8).lstrip()
+    if not text or b"\x00" in text:
+        return None
+    try:
+        # A multi-byte character may be cut at the end of the sample
+        codecs.getincrementaldecoder("utf-8")().decode(text)
+    except UnicodeDecodeError:
+        return None
+    if text[:1] in (b"{", b"["):
+        return "application/json"
+    return "text/csv"
+
+
+def get_file_processor(mime_type: str, file_name: str, file_content: BinaryIO, document=None):
     """
     Determine the appropriate processor for the given file.
 
     Args:
         mime_type (str): The MIME type of the file (e.g., "text/csv" or "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet").
         file_name (str): The name of the file.
-        file_content (bytes): The content of the file.
+        file_content (BinaryIO): The content of the file, as a seekable binary file.
+        document (ParsedDocument, optional): Parsed forms of the file shared
+            with the processor, so the workbook is parsed only once.
 
     Returns:
         Processor: An instance of the selected processor.
     """
     try:
+        # Unknown extension, look at the content itself
+        sniffed_mime_type = sniff_mime_type(file_content)
+        if mime_type == "application/octet-stream" and sniffed_mime_type:
+            logger.info(f"Detected {sniffed_mime_type} from file content")
+            mime_type = sniffed_mime_type
+
         # First check if this is a Mother Parkers Excel file
-        if is_excel_file(file_name) and mime_type in ["application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "application/octet-stream"]:
-            if is_mother_parkers_format(file_content):
+        if is_excel_file(file_name) and mime_type in [XLSX_MIME_TYPE, "application/octet-stream"]:
+            if sniffed_mime_type == XLSX_MIME_TYPE and is_mother_parkers_document(file_content, document):
                 # Import here to avoid circular imports
                 from app.file_processing.processors_mother_parkers import MotherParkersExcelProcessor
                 logger.info("Processing as Mother Parkers Excel file")
@@ -25,17 +77,23 @@ def get_file_processor(mime_type: str, file_name: str, file_content: bytes):
                 # Set file context for the processor
                 processor.context = {
                     'bucket_name': None,  # Will be set in logic.py
-                    'file_path': file_name
+                    'file_path': file_name,
+                    'document': document
                 }
                 return processor
 
         # Regular file processing logic
-        if mime_type in ["application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "application/octet-stream"]:
+        if mime_type in [XLSX_MIME_TYPE, "application/octet-stream"]:
             logger.info("Processing as regular Excel file")
             return XLSXProcessor()
         elif mime_type in ["text/csv"]:
             logger.info("Processing as CSV file")
-            decoded_content = file_content.decode("utf-8")  # Adjust encoding if needed
+            # Check the content decodes, chunk by chunk to keep memory flat
+            decoder = codecs.getincrementaldecoder("utf-8")()  # Adjust encoding if needed
+            file_content.seek(0)
+            for chunk in iter(lambda: file_content.read(CHUNK_SIZE), b""):
+                decoder.decode(chunk)
+            decoder.decode(b"", final=True)
             return CSVProcessor()
         elif mime_type in ["application/json"]:
             logger.info("Processing as JSON file")
@@ -47,38 +105,68 @@ def get_file_processor(mime_type: str, file_name: str, file_content: bytes):
         raise RuntimeError(f"Error processing file: {str(e)}") from e
 
 
+def is_mother_parkers_document(file_content: BinaryIO, document=None) -> bool:
+    """
+    Check the Mother Parkers format, reusing the sheet names of the parsed document if any.
+    """
+    try:
+        sheet_names = document.sheet_names if document else read_sheet_names(file_content)
+        return has_mother_parkers_sheets(sheet_names)
+    except Exception as e:
+        logger.error(f"Error checking Excel format: {e}")
+        return False
+
+
 class FileProcessor(ABC):
+    # True when the processed output is identical to the input, the pipeline
+    # then copies the original object server-side instead of uploading bytes
+    passthrough = False
+
     def __init__(self):
         self.context = {}
         self.validation_report = None
+        # Row-level errors (ValidationErrorReport) written next to the validation report
+        self.error_report = None
+        # False when a stage such as a database load failed, the results of
+        # the file are then not reused for later uploads of the same content
+        self.results_reusable = True
         
     @abstractmethod
-    def process(self, file_content: bytes) -> bytes:
+    def process(self, file_content: BinaryIO):
         """
         Process the file content and return the processed output.
 
         Args:
-            file_content (bytes): The raw content of the file.
+            file_content (BinaryIO): The raw content of the file, as a seekable
+                binary file positioned at its start.
 
         Returns:
-            bytes: The processed content.
+            bytes or file-like: The processed content, or a callable producing
+            it when the outputs are written, or None when the processor has
+            no processed output.
         """
         pass
 
 class JSONProcessor(FileProcessor):
-    def process(self, file_content: bytes) -> bytes:
+    passthrough = True
+
+    def process(self, file_content: BinaryIO) -> BinaryIO:
         # Example processing logic for JSON files
         # For demonstration, this just returns the same content
         return file_content
 
 class CSVProcessor(FileProcessor):
-    def process(self, file_content: bytes) -> bytes:
+    passthrough = True
+
+    def process(self, file_content: BinaryIO) -> BinaryIO:
         # Example processing logic for CSV files
         # For demonstration, this just returns the same content
         return file_content
 
 class XLSXProcessor(FileProcessor):
-    def process(self, file_content: bytes) -> bytes:
+    passthrough = True
+
+    def process(self, file_content: BinaryIO) -> BinaryIO:
         # Example processing logic for Excel files
         # For demonstration, this just returns the same content
         return file_content
\ No newline at end of file
@@ -2,27 +2,45 @@ from app.file_processing.processors import FileProcessor
 from app.utils.logger import logger
 from app.file_processing.excel_validation.validator import ExcelValidator
 from app.file_processing.excel_validation.loader import backup_file_to_gcs, is_mother_parkers_format
+from app.file_processing.excel_validation.document import ParsedDocument
+from app.file_processing.excel_validation.error_report import ERROR_REPORT_FORMATS
 from app.file_processing.mother_parkers.db_operations import DBOperations
 import urllib.parse
 import os
 from app.core.config import settings
+from app.utils.helpers import file_sha256
+from functools import partial
+from typing import BinaryIO
 
 class MotherParkersExcelProcessor(FileProcessor):
 
     
-    def process(self, file_content: bytes) -> bytes:
+    def process(self, file_content: BinaryIO) -> bytes:
 
         logger.info("Procesando archivo Excel de Mother Parkers")
         
         try:
+            # Formato del reporte de errores, verificado antes de tocar la BD
+            error_report_format = settings.validation_error_report_format
+            if error_report_format and error_report_format not in ERROR_REPORT_FORMATS:
+                raise ValueError(
+                    f"VALIDATION_ERROR_REPORT_FORMAT no soportado: '{error_report_format}' "
+                    f"(valores válidos: {', '.join(ERROR_REPORT_FORMATS)})"
+                )
+            
             # backup of the original file
             bucket_name = self.context.get('bucket_name', 'default-bucket')
             file_path = self.context.get('file_path', 'unknown-file.xlsx')
-            backup_file_to_gcs(bucket_name, file_path, file_content)
+            content_sha256 = self.context.get('content_sha256') or file_sha256(file_content)
+            backup_file_to_gcs(bucket_name, file_path, content_sha256)
             
-            # Validate the Excel file
+            # Validate the Excel file, the parsed workbook is shared with the DB stage
+            document = self.context.get('document') or ParsedDocument(file_content, content_sha256)
             validator = ExcelValidator()
-            processed_content, validation_report, workbook = validator.validate_workbook_bytes(file_content)
+            processed_content, validation_report, workbook = validator.validate_document(document, write_output=False)
+            progress = self.context.get('progress')
+            if progress:
+                progress("validated")
             
             # Log validation 
             valid_rows = validation_report['stats']['valid_rows']
@@ -31,24 +49,33 @@ class MotherParkersExcelProcessor(FileProcessor):
             
             # Store validation report as metadata
             self.validation_report = validation_report
+            if settings.validation_error_report_format:
+                self.error_report = validator.errors
             
             
             if valid_rows > 0:
-                self.process_database_operations(workbook, validation_report)
+                self.process_database_operations(workbook, validation_report, validator.row_errors)
             
-            return processed_content
+            if processed_content is not None:
+                return processed_content
+            if not settings.validation_output_workbook:
+                logger.info("Libro anotado deshabilitado, solo se generan los reportes")
+                return None
+            # El libro anotado se guarda al subir los resultados, después de la BD
+            return partial(validator.save_workbook, workbook)
             
         except Exception as e:
             logger.error(f"Error al procesar archivo Excel de Mother Parkers: {e}")
             raise RuntimeError(f"Error al procesar archivo Excel de Mother Parkers: {str(e)}")
 
-    def process_database_operations(self, workbook, validation_report):
+    def process_database_operations(self, workbook, validation_report, row_errors=None):
         """
         
         
         Args:
             workbook: Openpyxl workbook object
             validation_report: Dictionary with validation results
+            row_errors: Per-row error bitmap of the validation (RowErrors)
         """
         try:
             # Get database connection string from environment variables
@@ -58,10 +85,13 @@ class MotherParkersExcelProcessor(FileProcessor):
             logger.info("Iniciando operaciones de base de datos para Mother Parkers")
             
             
-            db_ops = DBOperations(db_url, use_db=True, single_record_mode=False)
+            db_ops = DBOperations(
+                db_url, use_db=True, single_record_mode=False,
+                progress_callback=self.context.get('progress')
+            )
             
             
-            results = db_ops.process_workbook(workbook)
+            results = db_ops.process_workbook(workbook, row_errors)
             
             
             logger.info(f"Resultados de procesamiento de BD: {results['entities_processed']} entidades, {results['transactions_processed']} transacciones")
@@ -72,9 +102,18 @@ class MotherParkersExcelProcessor(FileProcessor):
                 "transactions_processed": results["transactions_processed"],
                 "errors": results["errors"]
             }
+            # Sin conexión, con errores o con transacciones no inscritas, el
+            # archivo se vuelve a cargar en la BD si se sube de nuevo
+            if (
+                not db_ops.use_db
+                or results["errors"]
+                or db_ops.transactions_processed < results["transactions_processed"]
+            ):
+                self.results_reusable = False
             
         except Exception as e:
             logger.error(f"Error en operaciones de base de datos: {e}")
+            self.results_reusable = False
             self.validation_report["database_results"] = {
                 "error": str(e),
                 "entities_processed": 0,
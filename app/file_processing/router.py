@@ -1,67 +1,135 @@
+import asyncio
 import base64
 import json
-import os
-from fastapi import APIRouter, HTTPException, Depends, Path
-from sqlalchemy.orm import Session
+from typing import List, Optional
+from fastapi import APIRouter, HTTPException, Depends, Path, Query, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Session, selectinload
 from sqlalchemy.future import select
-from sqlalchemy import update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from app.core.config import settings
 from app.db.session import DatabaseManager
 from app.db.models.file_tasks import FileTasks, ProcessingStatus
-from app.db.models.datasets import Datasets, DatasetObjects
-from app.file_processing.logic import process_file_logic
+from app.db.models.datasets import Datasets, DatasetObjects, dataset_count_cache
+from app.file_processing.storage import get_storage_backend
+from app.task_management.progress import ProgressHub
+from app.task_management.scheduler import TaskScheduler, run_file_task
+from app.utils.helpers import TTLCache, decode_cursor, encode_cursor
 from app.utils.logger import logger
 from asyncio import CancelledError
-from datetime import timedelta
-from google.cloud import storage
-from google.oauth2 import service_account
+from datetime import datetime, timedelta
 
 router = APIRouter()
 
+MAX_BULK_FILE_IDS = 1000
+MAX_TASKS_PAGE_SIZE = 500
 
-# Decode and authenticate
-def get_storage_client():
-    encoded_key = os.getenv("SERVICE_ACCOUNT_INFO_JSON_BASE64")
-    if not encoded_key:
-        raise ValueError("SERVICE_ACCOUNT_INFO_JSON_BASE64 is not set")
 
-    service_account_info = json.loads(base64.b64decode(encoded_key))
-    credentials = service_account.Credentials.from_service_account_info(
-        service_account_info
+# Validity a cached signed URL keeps at least when it is served
+SIGNED_URL_MIN_VALIDITY_SECONDS = 60
+
+# Signed URLs are reused while they still have at least
+# (expiration - cache TTL) of validity left, the TTL is clamped so that is
+# never less than SIGNED_URL_MIN_VALIDITY_SECONDS
+signed_url_cache = TTLCache(
+    ttl=max(
+        0,
+        min(
+            settings.signed_url_cache_seconds,
+            settings.signed_url_expiration_minutes * 60 - SIGNED_URL_MIN_VALIDITY_SECONDS,
+        ),
     )
+)
+
 
-    return storage.Client(credentials=credentials)
+def get_signed_url(bucket_name: str, object_path: str) -> str:
+    """
+    Get a V4 signed download URL for an object, reusing a recently signed one.
+
+    Args:
+        bucket_name (str): Name of the bucket.
+        object_path (str): Path of the object in the bucket.
+
+    Returns:
+        str: Signed URL.
+    """
+    key = (bucket_name, object_path)
+    url = signed_url_cache.get(key)
+    if url is None:
+        url = get_storage_backend().generate_signed_url(
+            bucket_name,
+            object_path,
+            timedelta(minutes=settings.signed_url_expiration_minutes),
+        )
+        signed_url_cache.set(key, url)
+    return url
 
 
 @router.get("/list-datasets/{storage_path:path}")
-async def list_datasets(
+def list_datasets(
     storage_path: str = Path(
         ..., description="Storage path including bucket name and optional directory"
     ),
     category: str = "",
     page: int = 1,
     page_size: int = 10,
+    cursor: Optional[str] = None,
     db: Session = Depends(DatabaseManager.get_db),
 ):
+    """
+    List the datasets with processed objects under a storage path.
+
+    Pages are read by keyset on (created_at, id): pass the `next_cursor` of
+    a response as `cursor` to get the following page. `page` is kept for
+    older clients and is only used when no cursor is given.
+    """
     bucket_parts = storage_path.split("/", 1)
     bucket_name = bucket_parts[0]
     directory = bucket_parts[1] if len(bucket_parts) > 1 else ""
     prefix = f"{directory}/processed" if directory else "processed"
 
-    # Query the database
-    datasets_query = (
-        db.query(Datasets)
-        .join(DatasetObjects)
-        .filter(
-            DatasetObjects.bucket_name == bucket_name,
-            DatasetObjects.object_path.like(f"{prefix}%"),
-        )
+    # Query the database. Datasets are matched through a subquery instead of
+    # a join so a dataset with several matching objects is returned once.
+    matching_dataset_ids = select(DatasetObjects.dataset_id).filter(
+        DatasetObjects.bucket_name == bucket_name,
+        DatasetObjects.object_path.like(f"{prefix}%"),
+    )
+    datasets_query = db.query(Datasets).filter(
+        Datasets.dataset_id.in_(matching_dataset_ids)
     )
 
     if category:
         datasets_query = datasets_query.filter(Datasets.category == category)
 
-    total_datasets = datasets_query.count()
-    datasets = datasets_query.offset((page - 1) * page_size).limit(page_size).all()
+    count_key = (bucket_name, prefix, category)
+    total_datasets = dataset_count_cache.get(count_key)
+    if total_datasets is None:
+        total_datasets = datasets_query.count()
+        dataset_count_cache.set(count_key, total_datasets)
+
+    page_query = datasets_query.options(selectinload(Datasets.objects)).order_by(
+        Datasets.created_at, Datasets.id
+    )
+    if cursor:
+        try:
+            last_created_at, last_id = decode_cursor(cursor, (datetime, int))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        page_query = page_query.filter(
+            tuple_(Datasets.created_at, Datasets.id) > tuple_(last_created_at, last_id)
+        )
+    elif page > 1:
+        page_query = page_query.offset((page - 1) * page_size)
+
+    # The objects of the whole page are loaded with a single extra query
+    datasets = page_query.limit(page_size + 1).all()
+    next_cursor = None
+    if len(datasets) > page_size:
+        datasets = datasets[:page_size]
+        next_cursor = encode_cursor([datasets[-1].created_at, datasets[-1].id])
 
     # Build the response
     result = []
@@ -69,10 +137,7 @@ async def list_datasets(
         signed_urls = [
             {
                 "file_type": obj.file_type,
-                "download_url": get_storage_client()
-                .bucket(obj.bucket_name)
-                .blob(obj.object_path)
-                .generate_signed_url(expiration=timedelta(minutes=10), version="v4"),
+                "download_url": get_signed_url(obj.bucket_name, obj.object_path),
             }
             for obj in dataset.objects
         ]
@@ -93,6 +158,27 @@ async def list_datasets(
         "page_size": page_size,
         "total": total_datasets,
         "datasets": result,
+        "next_cursor": next_cursor,
+    }
+
+
+def serialize_task(task: FileTasks) -> dict:
+    """Build the status payload of a task."""
+    return {
+        "file_id": task.file_id,
+        "status": task.status,
+        "file_path": task.file_path,
+        "bucket": task.bucket,
+        "processors": task.processors,
+        "validation_csv_path": task.processed_output_path,
+        "processed_output_path": task.processed_output_path,
+        "validation_report_path": task.validation_report_path,
+        "error_report_path": task.error_report_path,
+        "content_sha256": task.content_sha256,
+        "deduplicated_from": task.deduplicated_from,
+        "progress": task.progress,
+        "created_at": task.created_at,
+        "updated_at": task.updated_at,
     }
 
 
@@ -110,27 +196,205 @@ def get_task_status(file_id: str, db: Session = Depends(DatabaseManager.get_db))
                 status_code=404, detail=f"No task found for file_id: {file_id}"
             )
         logger.info(f"Task found for file_id: {file_id} with status: {task.status}")
+        return serialize_task(task)
+    except Exception as e:
+        logger.error(f"Failed to fetch task status for file_id {file_id}: {e}")
+        raise HTTPException(status_code=500, detail="Error fetching task status")
+
+
+class BulkStatusRequest(BaseModel):
+    file_ids: List[str] = Field(..., max_length=MAX_BULK_FILE_IDS)
+
+
+@router.post("/status/bulk")
+def get_tasks_status(request: BulkStatusRequest, db: Session = Depends(DatabaseManager.get_db)):
+    """
+    Get the status of many file processing tasks with a single query.
+
+    Args:
+        request: Body with the list of file_ids.
+        db: Database session.
+
+    Returns:
+        dict: Status of the tasks found and the file_ids without a task.
+    """
+    file_ids = list(dict.fromkeys(request.file_ids))
+    logger.info(f"Fetching status for {len(file_ids)} file_ids")
+    result = db.execute(select(FileTasks).filter(FileTasks.file_id.in_(file_ids)))
+    tasks = {task.file_id: task for task in result.scalars().all()}
+    return {
+        "tasks": [serialize_task(tasks[file_id]) for file_id in file_ids if file_id in tasks],
+        "not_found": [file_id for file_id in file_ids if file_id not in tasks],
+    }
+
+
+@router.get("/tasks")
+def list_tasks(
+    status: Optional[ProcessingStatus] = None,
+    bucket: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=MAX_TASKS_PAGE_SIZE),
+    db: Session = Depends(DatabaseManager.get_db),
+):
+    """
+    List file processing tasks, newest first, with keyset pagination.
+
+    Args:
+        status: Only tasks with this status.
+        bucket: Only tasks of this bucket.
+        created_from: Only tasks created at or after this time (UTC).
+        created_to: Only tasks created before this time (UTC).
+        cursor: `next_cursor` of the previous page.
+        limit: Page size.
+        db: Database session.
+
+    Returns:
+        dict: The page of tasks and the cursor of the next page, if any.
+    """
+    query = select(FileTasks)
+    if status:
+        query = query.filter(FileTasks.status == status)
+    if bucket:
+        query = query.filter(FileTasks.bucket == bucket)
+    if created_from:
+        query = query.filter(FileTasks.created_at >= created_from)
+    if created_to:
+        query = query.filter(FileTasks.created_at < created_to)
+    if cursor:
+        try:
+            last_created_at, last_id = decode_cursor(cursor, (datetime, int))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        query = query.filter(
+            tuple_(FileTasks.created_at, FileTasks.id) < tuple_(last_created_at, last_id)
+        )
+
+    query = query.order_by(FileTasks.created_at.desc(), FileTasks.id.desc()).limit(limit + 1)
+    tasks = db.execute(query).scalars().all()
+
+    next_cursor = None
+    if len(tasks) > limit:
+        tasks = tasks[:limit]
+        next_cursor = encode_cursor([tasks[-1].created_at, tasks[-1].id])
+
+    return {
+        "tasks": [serialize_task(task) for task in tasks],
+        "limit": limit,
+        "next_cursor": next_cursor,
+    }
+
+
+def load_task_snapshot(file_id: str) -> Optional[dict]:
+    """Read the status, progress and outputs of a task with a short-lived session."""
+    session = DatabaseManager.get_session_local()()
+    try:
+        result = session.execute(select(FileTasks).filter(FileTasks.file_id == file_id))
+        task = result.scalars().first()
+        if not task:
+            return None
         return {
             "file_id": task.file_id,
             "status": task.status,
-            "file_path": task.file_path,
-            "bucket": task.bucket,
-            "processors": task.processors,
-            "validation_csv_path": task.processed_output_path,
+            "progress": task.progress,
             "processed_output_path": task.processed_output_path,
+            "validation_report_path": task.validation_report_path,
+            "error_report_path": task.error_report_path,
         }
-    except Exception as e:
-        logger.error(f"Failed to fetch task status for file_id {file_id}: {e}")
-        raise HTTPException(status_code=500, detail="Error fetching task status")
+    finally:
+        session.close()
+
+
+def format_event(snapshot: dict, event_id: int) -> str:
+    """Encode a task snapshot as a server-sent event."""
+    return f"id: {event_id}\nevent: status\ndata: {json.dumps(snapshot, default=str)}\n\n"
+
+
+@router.get("/status/{file_id}/events")
+async def stream_task_status(file_id: str, timeout: Optional[float] = None):
+    """
+    Stream the status of a file processing task as server-sent events.
+
+    An event is sent with the current state and then on every status
+    transition or stage progress (downloaded, validated, entities N/M,
+    transactions N/M, uploaded) until the task is PROCESSED or FAILED or the
+    timeout expires. Updates from this instance's workers are pushed as they
+    happen; tasks processed by other instances are followed by reading the
+    task row every TASK_STATUS_POLL_INTERVAL seconds.
+    """
+    snapshot = await run_in_threadpool(load_task_snapshot, file_id)
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail=f"No task found for file_id: {file_id}")
+
+    if timeout is None:
+        timeout = settings.task_status_stream_timeout
+
+    async def events():
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + min(timeout, settings.task_status_stream_timeout)
+        wakeup = ProgressHub.subscribe(file_id)
+        try:
+            current = snapshot
+            event_id = 0
+            yield format_event(current, event_id)
+
+            seen_version = 0
+            while current["status"] == ProcessingStatus.PENDING:
+                wakeup.clear()
+                latest = ProgressHub.latest(file_id)
+                if latest and latest[0] > seen_version:
+                    seen_version, update = latest
+                else:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        await asyncio.wait_for(
+                            wakeup.wait(), min(remaining, settings.task_status_poll_interval)
+                        )
+                        continue
+                    except asyncio.TimeoutError:
+                        # Nothing published here, the task may be running on another instance
+                        update = await run_in_threadpool(load_task_snapshot, file_id)
+                        if update is None:
+                            break
+
+                if update.get("status") != current["status"] or update.get("progress") != current.get("progress"):
+                    current = update
+                    event_id += 1
+                    yield format_event(current, event_id)
+                else:
+                    # Keep intermediaries from closing an idle connection
+                    yield ": keep-alive\n\n"
+        finally:
+            ProgressHub.unsubscribe(file_id, wakeup)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @router.post("/files/process-file")
-def process_file(event_data: dict, db: Session = Depends(DatabaseManager.get_db)):
+def process_file(
+    event_data: dict,
+    response: Response,
+    async_mode: Optional[bool] = None,
+    db: Session = Depends(DatabaseManager.get_db),
+):
     """
     Triggered when a file is uploaded in the bucket. Process the file.
 
+    In async mode the task is recorded as PENDING and handed over to the
+    worker pool, and the request is answered with 202 right away.
+
     Args:
         event_data (dict): Event payload containing bucket and object names.
+        response: Outgoing response, used to set the 202 status code.
+        async_mode (bool, optional): Process in the background. Defaults to
+            the PROCESS_FILES_ASYNC setting.
         db: Database session.
 
     Returns:
@@ -158,45 +422,47 @@ def process_file(event_data: dict, db: Session = Depends(DatabaseManager.get_db)
     file_name, file_extension = file_base_name.rsplit(".", 1)
     file_id = file_name
 
-    # Check if task already exists
-    result = db.execute(select(FileTasks).filter(FileTasks.file_path == object_name))
-    existing_task = result.scalars().first()
+    if async_mode is None:
+        async_mode = settings.process_files_async
+
+    # Create a new task with PENDING status. The insert is a no-op when a
+    # task for the same file already exists, so duplicate deliveries handled
+    # concurrently by several instances are detected atomically.
+    values = dict(
+        file_id=file_id,
+        file_path=object_name,
+        bucket=bucket_name,
+        processors=[],
+        processed_output_path=None,
+        status=ProcessingStatus.PENDING,
+    )
+    if not async_mode:
+        # Processed inline, lease it right away so no queue worker claims it
+        queue = TaskScheduler.get_queue()
+        values.update(attempts=1, **queue.lease_values())
+
+    stmt = (
+        pg_insert(FileTasks)
+        .values(**values)
+        .on_conflict_do_nothing(index_elements=[FileTasks.file_id])
+        .returning(FileTasks.id)
+    )
+    inserted = db.execute(stmt).scalar()
+    db.commit()
 
-    if existing_task:
+    if inserted is None:
         logger.info("Task already exists for file path: %s", object_name)
         raise HTTPException(status_code=200, detail="Task already exists")
 
     try:
-        # Create a new task with PENDING status
-        new_task = FileTasks(
-            file_id=file_id,
-            file_path=object_name,
-            bucket=bucket_name,
-            processors=[],
-            processed_output_path=None,
-            status=ProcessingStatus.PENDING,
-        )
-        db.add(new_task)
-        db.commit()
+        if async_mode:
+            TaskScheduler.submit(file_id)
+            response.status_code = 202
+            return {"status": "accepted", "file_id": file_id}
 
-        # Call the processing logic
-        result = process_file_logic(bucket_name, object_name, db)
-        new_task.processed_output_path = (
-            f"gs://{bucket_name}/{result['processed_output_path']}"
-        )
-        new_task.status = ProcessingStatus.PROCESSED
-        db.commit()
-
-        # Update task status to PROCESSED
-        stmt = (
-            update(FileTasks)
-            .where(FileTasks.file_id == file_id)
-            .values(
-                status=ProcessingStatus.PROCESSED, processors=result.get("processors")
-            )
-        )
-        db.execute(stmt)
-        db.commit()
+        # Call the processing logic, the task status is updated by the runner
+        with TaskScheduler.hold(file_id):
+            result = run_file_task(file_id, db, TaskScheduler.get_queue())
 
         return {"status": "success", "details": result}
     except CancelledError:
@@ -204,12 +470,4 @@ def process_file(event_data: dict, db: Session = Depends(DatabaseManager.get_db)
         raise
     except Exception as e:
         logger.error("Error processing file: %s", e)
-        # Update task status to FAILED
-        stmt = (
-            update(FileTasks)
-            .where(FileTasks.file_id == file_id)
-            .values(status=ProcessingStatus.FAILED)
-        )
-        db.execute(stmt)
-        db.commit()
         raise HTTPException(status_code=200, detail="Failed to process file")
@@ -0,0 +1,192 @@
+import base64
+import json
+import os
+import shutil
+from abc import ABC, abstractmethod
+from datetime import timedelta
+from functools import lru_cache
+from pathlib import Path
+from typing import BinaryIO, Optional, Union
+from app.core.config import settings
+from app.utils.logger import logger
+
+Content = Union[bytes, str, BinaryIO]
+
+
+class StorageBackend(ABC):
+    """Object storage used by the file processing pipeline."""
+
+    @abstractmethod
+    def open(self, bucket_name: str, object_name: str, chunk_size: Optional[int] = None) -> BinaryIO:
+        """
+        Open an object for streaming reads.
+
+        Args:
+            bucket_name (str): Name of the bucket.
+            object_name (str): Path of the object in the bucket.
+            chunk_size (int, optional): Size of the reads issued to the storage.
+
+        Returns:
+            BinaryIO: Readable binary stream, to be closed by the caller.
+        """
+        pass
+
+    @abstractmethod
+    def upload(self, bucket_name: str, object_name: str, content: Content, content_type: Optional[str] = None):
+        """
+        Write an object with the given content.
+
+        Args:
+            bucket_name (str): Name of the bucket.
+            object_name (str): Path of the object in the bucket.
+            content (bytes, str or file-like): Content of the object, file-like
+                content is streamed from its start.
+            content_type (str, optional): Content type of the object.
+        """
+        pass
+
+    @abstractmethod
+    def copy(self, source_bucket: str, source_path: str, destination_bucket: str, destination_path: str):
+        """
+        Copy an object inside the storage, without reading it into this process.
+        """
+        pass
+
+    @abstractmethod
+    def delete(self, bucket_name: str, object_name: str):
+        """
+        Delete an object.
+        """
+        pass
+
+    @abstractmethod
+    def exists(self, bucket_name: str, object_name: str) -> bool:
+        """
+        Check whether an object exists.
+        """
+        pass
+
+    @abstractmethod
+    def generate_signed_url(self, bucket_name: str, object_name: str, expiration: timedelta) -> str:
+        """
+        Build a URL that allows downloading the object until it expires.
+        """
+        pass
+
+
+class GCSStorageBackend(StorageBackend):
+    """
+    Google Cloud Storage backend sharing one client, and therefore one pool
+    of HTTP connections, between all the operations of the process.
+    """
+
+    def __init__(self, pool_size: int = settings.storage_pool_size):
+        from google.cloud import storage
+        from google.oauth2 import service_account
+        from requests.adapters import HTTPAdapter
+
+        # Pipeline reads and writes use the default credentials of the environment
+        self.client = storage.Client()
+
+        # Service account credentials are only used to sign URLs, fall back to
+        # the default credentials when they are not configured
+        encoded_key = os.getenv("SERVICE_ACCOUNT_INFO_JSON_BASE64")
+        if encoded_key:
+            service_account_info = json.loads(base64.b64decode(encoded_key))
+            credentials = service_account.Credentials.from_service_account_info(
+                service_account_info
+            )
+            self.signing_client = storage.Client(credentials=credentials)
+        else:
+            self.signing_client = self.client
+
+        # The default requests pool keeps 10 connections, size it for the
+        # concurrent workers sharing this client
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.client._http.mount("https://", adapter)
+
+    def open(self, bucket_name, object_name, chunk_size=None):
+        blob = self.client.bucket(bucket_name).blob(object_name)
+        return blob.open("rb", chunk_size=chunk_size)
+
+    def upload(self, bucket_name, object_name, content, content_type=None):
+        blob = self.client.bucket(bucket_name).blob(object_name)
+        if isinstance(content, (bytes, str)):
+            blob.upload_from_string(content, content_type=content_type)
+        else:
+            blob.upload_from_file(content, content_type=content_type, rewind=True)
+
+    def copy(self, source_bucket, source_path, destination_bucket, destination_path):
+        bucket = self.client.bucket(source_bucket)
+        bucket.copy_blob(
+            bucket.blob(source_path), self.client.bucket(destination_bucket), destination_path
+        )
+
+    def delete(self, bucket_name, object_name):
+        self.client.bucket(bucket_name).blob(object_name).delete()
+
+    def exists(self, bucket_name, object_name):
+        return self.client.bucket(bucket_name).blob(object_name).exists()
+
+    def generate_signed_url(self, bucket_name, object_name, expiration):
+        blob = self.signing_client.bucket(bucket_name).blob(object_name)
+        return blob.generate_signed_url(expiration=expiration, version="v4")
+
+
+class LocalStorageBackend(StorageBackend):
+    """
+    Storage backend on a local directory, each bucket being a subdirectory.
+
+    Allows running and benchmarking the whole ingest path without network.
+    """
+
+    def __init__(self, root: str = settings.local_storage_root):
+        self.root = Path(root)
+
+    def path(self, bucket_name: str, object_name: str) -> Path:
+        return self.root / bucket_name / object_name
+
+    def open(self, bucket_name, object_name, chunk_size=None):
+        return open(self.path(bucket_name, object_name), "rb")
+
+    def upload(self, bucket_name, object_name, content, content_type=None):
+        path = self.path(bucket_name, object_name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        if isinstance(content, bytes):
+            path.write_bytes(content)
+        else:
+            content.seek(0)
+            with open(path, "wb") as destination:
+                shutil.copyfileobj(content, destination)
+
+    def copy(self, source_bucket, source_path, destination_bucket, destination_path):
+        destination = self.path(destination_bucket, destination_path)
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(self.path(source_bucket, source_path), destination)
+
+    def delete(self, bucket_name, object_name):
+        self.path(bucket_name, object_name).unlink()
+
+    def exists(self, bucket_name, object_name):
+        return self.path(bucket_name, object_name).is_file()
+
+    def generate_signed_url(self, bucket_name, object_name, expiration):
+        return self.path(bucket_name, object_name).resolve().as_uri()
+
+
+@lru_cache(maxsize=1)
+def get_storage_backend() -> StorageBackend:
+    """
+    Get the process-wide storage backend selected by the STORAGE_BACKEND setting.
+
+    Returns:
+        StorageBackend: "gcs" (default) or "local" backend.
+    """
+    if settings.storage_backend == "local":
+        logger.info(f"Using local storage backend at {settings.local_storage_root}")
+        return LocalStorageBackend()
+    if settings.storage_backend == "gcs":
+        return GCSStorageBackend()
+    raise ValueError(f"Unsupported storage backend: {settings.storage_backend}")
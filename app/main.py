@@ -2,6 +2,7 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.core.config import settings
 from app.file_processing.router import router as file_router
+from app.task_management.scheduler import TaskScheduler
 from app.utils.logger import logger
 
 logger.info("Starting the COSA Core Engine")
@@ -29,3 +30,15 @@ app.add_middleware(
 
 # Include routers
 app.include_router(file_router, prefix="/file-tasks", tags=["File Processing"])
+
+
+@app.on_event("startup")
+def start_scheduler():
+    """Start claiming queued file tasks on this instance."""
+    TaskScheduler.start()
+
+
+@app.on_event("shutdown")
+def shutdown_scheduler():
+    """Let running file tasks finish before the instance stops."""
+    TaskScheduler.shutdown()
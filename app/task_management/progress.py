@@ -0,0 +1,153 @@
+import asyncio
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import update
+from app.core.config import settings
+from app.db.session import DatabaseManager
+from app.db.models.file_tasks import FileTasks, ProcessingStatus
+from app.utils.logger import logger
+
+# Seconds a finished task stays in the hub for late subscribers
+FINISHED_RETENTION_SECONDS = 60
+# Minimum seconds between two published updates of the same stage
+PUBLISH_INTERVAL_SECONDS = 0.5
+
+
+class ProgressHub:
+    """
+    In-process publisher of task status and progress snapshots.
+
+    Workers publish from their threads; subscribers are coroutines of the
+    streaming status endpoint waiting on an asyncio.Event that is set
+    through their own event loop.
+    """
+
+    __snapshots: Dict[str, Tuple[int, Dict[str, Any]]] = {}
+    __subscribers: Dict[str, List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]]] = {}
+    __finished: Dict[str, float] = {}
+    __lock = threading.Lock()
+    __version = 0
+
+    @classmethod
+    def publish(cls, file_id: str, snapshot: Dict[str, Any]):
+        """
+        Publish the latest snapshot of a task and wake up its subscribers.
+
+        Args:
+            file_id (str): Identifier of the task.
+            snapshot (dict): Status, progress and outputs of the task.
+        """
+        with cls.__lock:
+            cls.__version += 1
+            cls.__snapshots[file_id] = (cls.__version, snapshot)
+            if snapshot.get("status") != ProcessingStatus.PENDING:
+                cls.__finished[file_id] = time.monotonic()
+            subscribers = list(cls.__subscribers.get(file_id, []))
+            cls._prune()
+
+        for loop, event in subscribers:
+            loop.call_soon_threadsafe(event.set)
+
+    @classmethod
+    def discard(cls, file_id: str):
+        """
+        Drop the snapshot of a task this instance no longer processes.
+
+        Subscribers are woken up and follow the task row from then on.
+
+        Args:
+            file_id (str): Identifier of the task.
+        """
+        with cls.__lock:
+            cls.__snapshots.pop(file_id, None)
+            cls.__finished.pop(file_id, None)
+            subscribers = list(cls.__subscribers.get(file_id, []))
+
+        for loop, event in subscribers:
+            loop.call_soon_threadsafe(event.set)
+
+    @classmethod
+    def latest(cls, file_id: str) -> Optional[Tuple[int, Dict[str, Any]]]:
+        """Latest (version, snapshot) published for a task on this instance."""
+        with cls.__lock:
+            return cls.__snapshots.get(file_id)
+
+    @classmethod
+    def subscribe(cls, file_id: str) -> asyncio.Event:
+        """Register the running coroutine to be woken up on new snapshots."""
+        event = asyncio.Event()
+        with cls.__lock:
+            cls.__subscribers.setdefault(file_id, []).append(
+                (asyncio.get_running_loop(), event)
+            )
+        return event
+
+    @classmethod
+    def unsubscribe(cls, file_id: str, event: asyncio.Event):
+        with cls.__lock:
+            subscribers = [
+                item for item in cls.__subscribers.get(file_id, []) if item[1] is not event
+            ]
+            if subscribers:
+                cls.__subscribers[file_id] = subscribers
+            else:
+                cls.__subscribers.pop(file_id, None)
+
+    @classmethod
+    def _prune(cls):
+        cutoff = time.monotonic() - FINISHED_RETENTION_SECONDS
+        for file_id, finished_at in list(cls.__finished.items()):
+            if finished_at < cutoff:
+                cls.__finished.pop(file_id)
+                cls.__snapshots.pop(file_id, None)
+
+
+class TaskProgressReporter:
+    """
+    Progress callback handed to the processing pipeline of one task.
+
+    Called as `progress(stage, current, total)`. Updates are published to
+    the ProgressHub (throttled within a stage) and persisted on the task
+    row at most every TASK_PROGRESS_PERSIST_INTERVAL seconds, so instances
+    that are not processing the task can serve it too.
+    """
+
+    def __init__(self, file_id: str):
+        self.file_id = file_id
+        self.progress: Dict[str, Any] = {}
+        self._last_publish = 0.0
+        self._last_persist = 0.0
+
+    def __call__(self, stage: str, current: Optional[int] = None, total: Optional[int] = None):
+        now = time.monotonic()
+        stage_changed = stage != self.progress.get("stage")
+        completed = current is not None and current == total
+        if not (stage_changed or completed) and now - self._last_publish < PUBLISH_INTERVAL_SECONDS:
+            return
+
+        self.progress = {"stage": stage, "current": current, "total": total}
+        self._last_publish = now
+        ProgressHub.publish(
+            self.file_id,
+            {"file_id": self.file_id, "status": ProcessingStatus.PENDING, "progress": self.progress},
+        )
+
+        if stage_changed or completed or now - self._last_persist >= settings.task_progress_persist_interval:
+            self._last_persist = now
+            self._persist()
+
+    def _persist(self):
+        session = DatabaseManager.get_session_local()()
+        try:
+            session.execute(
+                update(FileTasks)
+                .where(FileTasks.file_id == self.file_id)
+                .values(progress=self.progress)
+            )
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            logger.error(f"Error saving progress of task {self.file_id}: {e}")
+        finally:
+            session.close()
@@ -0,0 +1,458 @@
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+from typing import List, Optional, Set
+from sqlalchemy import func, or_, update
+from sqlalchemy.future import select
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.db.session import DatabaseManager
+from app.db.models.file_tasks import FileTasks, ProcessingStatus
+from app.file_processing.logic import process_file_logic
+from app.task_management.progress import ProgressHub, TaskProgressReporter
+from app.utils.logger import logger
+
+
+def db_utcnow():
+    """Current UTC time according to the database, comparable to the naive UTC columns."""
+    return func.timezone("utc", func.now())
+
+
+class LeaseLostError(RuntimeError):
+    """The queue lease of a task is now held by another worker, or expired."""
+
+
+def run_file_task(file_id: str, db: Session, queue: Optional["FileTaskQueue"] = None) -> dict:
+    """
+    Process the file of a PENDING task and record the outcome.
+
+    The task is moved to PROCESSED when the processing logic succeeds and
+    to FAILED otherwise; in the latter case the original exception is
+    re-raised after the status has been committed. Either way the queue
+    lease on the task is released.
+
+    With a queue, the run is fenced by its lease, identified by the worker
+    and the attempt: the lease is renewed at every stage, the database stage
+    included, periodically within a stage and right before the outputs are
+    written, and the processing is aborted when it is lost. The final status
+    is only recorded while the run still holds the lease; otherwise the task
+    is left to the run that claimed it again.
+
+    Args:
+        file_id (str): Identifier of the task to process.
+        db: Database session.
+        queue (FileTaskQueue, optional): Queue whose worker leased the task.
+
+    Returns:
+        dict: Details of the processing.
+    """
+    result = db.execute(select(FileTasks).filter(FileTasks.file_id == file_id))
+    task = result.scalars().first()
+    if not task:
+        raise ValueError(f"No task found for file_id: {file_id}")
+    bucket_name = task.bucket
+    file_path = task.file_path
+    attempt = task.attempts
+    # The session is not left idle in a transaction while the file is processed
+    db.commit()
+
+    progress = TaskProgressReporter(file_id)
+    renewed_at = time.monotonic()
+
+    def ensure_lease():
+        nonlocal renewed_at
+        if queue is None:
+            return
+        if not queue.renew(db, file_id, attempt):
+            raise LeaseLostError(f"Lease of task {file_id} lost, processing aborted")
+        renewed_at = time.monotonic()
+
+    def fenced_progress(stage: str, current: Optional[int] = None, total: Optional[int] = None):
+        if queue is not None and (
+            stage != progress.progress.get("stage")
+            or time.monotonic() - renewed_at >= queue.lease.total_seconds() / 3
+        ):
+            ensure_lease()
+        progress(stage, current, total)
+
+    # Final status updates only apply while this run holds the lease
+    owned = [FileTasks.file_id == file_id]
+    if queue is not None:
+        owned += [FileTasks.lease_owner == queue.worker_id, FileTasks.attempts == attempt]
+
+    try:
+        result = process_file_logic(
+            bucket_name, file_path, db, progress=fenced_progress, before_finish=ensure_lease
+        )
+    except Exception:
+        db.rollback()
+        stmt = (
+            update(FileTasks)
+            .where(*owned)
+            .values(
+                status=ProcessingStatus.FAILED,
+                progress=progress.progress,
+                lease_owner=None,
+                lease_expires_at=None,
+            )
+        )
+        updated = db.execute(stmt).rowcount
+        db.commit()
+        if not updated:
+            logger.warning(f"Task {file_id} is leased by another run, its failure was not recorded")
+            ProgressHub.discard(file_id)
+            raise
+        ProgressHub.publish(
+            file_id,
+            {"file_id": file_id, "status": ProcessingStatus.FAILED, "progress": progress.progress},
+        )
+        raise
+
+    processed_output_path = result.get("processed_output_path")
+    validation_report_path = result.get("validation_report_path")
+    error_report_path = result.get("error_report_path")
+    values = dict(
+        status=ProcessingStatus.PROCESSED,
+        processors=result.get("processors", []),
+        processed_output_path=(
+            f"gs://{bucket_name}/{processed_output_path}" if processed_output_path else None
+        ),
+        validation_report_path=(
+            f"gs://{bucket_name}/{validation_report_path}" if validation_report_path else None
+        ),
+        error_report_path=f"gs://{bucket_name}/{error_report_path}" if error_report_path else None,
+        content_sha256=result.get("content_sha256"),
+        deduplicated_from=result.get("deduplicated_from"),
+        results_reusable=result.get("results_reusable", False),
+        progress=progress.progress,
+    )
+    stmt = (
+        update(FileTasks)
+        .where(*owned)
+        .values(lease_owner=None, lease_expires_at=None, **values)
+    )
+    updated = db.execute(stmt).rowcount
+    db.commit()
+    if not updated:
+        logger.warning(f"Task {file_id} is leased by another run, its outcome was not recorded")
+        ProgressHub.discard(file_id)
+        return result
+    ProgressHub.publish(file_id, {"file_id": file_id, **values})
+    logger.info(f"Task {file_id} processed")
+    return result
+
+
+class FileTaskQueue:
+    """
+    Work queue backed by the FileTasks table.
+
+    A PENDING task is available when it has no lease or its lease has
+    expired. Workers claim tasks with SELECT ... FOR UPDATE SKIP LOCKED, so
+    concurrent replicas never claim the same row, and keep their lease
+    alive with heartbeats while the task runs. A task whose worker died is
+    claimed again once its lease expires, up to `max_attempts` times.
+    """
+
+    def __init__(
+        self,
+        worker_id: str,
+        lease_seconds: int = settings.task_lease_seconds,
+        max_attempts: int = settings.task_max_attempts,
+    ):
+        self.worker_id = worker_id
+        self.lease = timedelta(seconds=lease_seconds)
+        self.max_attempts = max_attempts
+
+    def lease_values(self) -> dict:
+        """Column values that put a task under this worker's lease."""
+        return {
+            "lease_owner": self.worker_id,
+            "lease_expires_at": db_utcnow() + self.lease,
+            "heartbeat_at": db_utcnow(),
+        }
+
+    def claim(self, db: Session, limit: int = 1) -> List[str]:
+        """
+        Lease up to `limit` available tasks to this worker.
+
+        Args:
+            db: Database session.
+            limit (int): Maximum number of tasks to claim.
+
+        Returns:
+            list: file_id of the claimed tasks, oldest first.
+        """
+        stmt = (
+            select(FileTasks.id, FileTasks.file_id)
+            .where(
+                FileTasks.status == ProcessingStatus.PENDING,
+                or_(
+                    FileTasks.lease_expires_at.is_(None),
+                    FileTasks.lease_expires_at < db_utcnow(),
+                ),
+                FileTasks.attempts < self.max_attempts,
+            )
+            .order_by(FileTasks.created_at, FileTasks.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        rows = db.execute(stmt).all()
+        if not rows:
+            db.rollback()
+            return []
+
+        stmt = (
+            update(FileTasks)
+            .where(FileTasks.id.in_([row.id for row in rows]))
+            .values(attempts=FileTasks.attempts + 1, **self.lease_values())
+        )
+        db.execute(stmt)
+        db.commit()
+
+        file_ids = [row.file_id for row in rows]
+        logger.info(f"Worker {self.worker_id} claimed tasks: {file_ids}")
+        return file_ids
+
+    def heartbeat(self, db: Session, file_ids: List[str]) -> Set[str]:
+        """
+        Extend the lease of tasks held by this worker.
+
+        Args:
+            db: Database session.
+            file_ids (list): Tasks currently being processed by this worker.
+
+        Returns:
+            set: file_id of the tasks whose lease is still held.
+        """
+        if not file_ids:
+            return set()
+
+        stmt = (
+            update(FileTasks)
+            .where(
+                FileTasks.file_id.in_(file_ids),
+                FileTasks.lease_owner == self.worker_id,
+                FileTasks.status == ProcessingStatus.PENDING,
+            )
+            .values(**self.lease_values())
+            .returning(FileTasks.file_id)
+        )
+        held = set(db.execute(stmt).scalars().all())
+        db.commit()
+        return held
+
+    def renew(self, db: Session, file_id: str, attempt: int) -> bool:
+        """
+        Extend the lease of one run of a task.
+
+        Unlike `heartbeat`, the run is also identified by its attempt, so it
+        no longer holds the lease once the task has been claimed again, even
+        by this worker.
+
+        Args:
+            db: Database session.
+            file_id (str): Identifier of the task.
+            attempt (int): Attempt number of the run, as set by its claim.
+
+        Returns:
+            bool: Whether the run still holds the lease.
+        """
+        stmt = (
+            update(FileTasks)
+            .where(
+                FileTasks.file_id == file_id,
+                FileTasks.lease_owner == self.worker_id,
+                FileTasks.attempts == attempt,
+                FileTasks.status == ProcessingStatus.PENDING,
+            )
+            .values(**self.lease_values())
+            .returning(FileTasks.id)
+        )
+        held = db.execute(stmt).first() is not None
+        db.commit()
+        return held
+
+    def fail_exhausted(self, db: Session) -> int:
+        """
+        Mark as FAILED the abandoned tasks that already used all their attempts.
+
+        Args:
+            db: Database session.
+
+        Returns:
+            int: Number of tasks marked as FAILED.
+        """
+        stmt = (
+            update(FileTasks)
+            .where(
+                FileTasks.status == ProcessingStatus.PENDING,
+                FileTasks.lease_expires_at < db_utcnow(),
+                FileTasks.attempts >= self.max_attempts,
+            )
+            .values(status=ProcessingStatus.FAILED, lease_owner=None, lease_expires_at=None)
+        )
+        failed = db.execute(stmt).rowcount
+        db.commit()
+        if failed:
+            logger.warning(f"{failed} abandoned tasks exhausted their attempts and were marked as FAILED")
+        return failed
+
+
+class TaskScheduler:
+    """
+    Worker pool that processes file tasks outside of the request lifecycle.
+
+    Every instance runs a poller that claims tasks from the FileTaskQueue
+    as long as the pool has free slots, and a heartbeat that keeps the
+    leases of the running tasks alive.
+    """
+
+    __executor: Optional[ThreadPoolExecutor] = None
+    __queue: Optional[FileTaskQueue] = None
+    __threads: List[threading.Thread] = []
+    __active: Set[str] = set()
+    __lock = threading.Lock()
+    __wakeup = threading.Event()
+    __stop = threading.Event()
+
+    @classmethod
+    def get_executor(cls) -> ThreadPoolExecutor:
+        """Lazy initialization of the worker pool."""
+        if cls.__executor is None:
+            cls.__executor = ThreadPoolExecutor(
+                max_workers=settings.task_workers, thread_name_prefix="file-task"
+            )
+        return cls.__executor
+
+    @classmethod
+    def get_queue(cls) -> FileTaskQueue:
+        """Lazy initialization of the queue, identified by a per-process worker id."""
+        if cls.__queue is None:
+            worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+            cls.__queue = FileTaskQueue(worker_id)
+        return cls.__queue
+
+    @classmethod
+    def start(cls):
+        """Start the poller and heartbeat threads if they are not running yet."""
+        with cls.__lock:
+            if cls.__threads:
+                return
+            cls.__stop.clear()
+            cls.__threads = [
+                threading.Thread(target=cls._poll, name="file-task-poller", daemon=True),
+                threading.Thread(target=cls._heartbeat, name="file-task-heartbeat", daemon=True),
+            ]
+            for thread in cls.__threads:
+                thread.start()
+        logger.info(f"Task scheduler started as worker {cls.get_queue().worker_id}")
+
+    @classmethod
+    def submit(cls, file_id: str):
+        """
+        Signal that a PENDING task is waiting in the queue.
+
+        The task is processed by whichever instance claims it first; the
+        local poller is woken up so it does not wait for the next interval.
+
+        Args:
+            file_id (str): Identifier of the queued task.
+        """
+        logger.info(f"Task {file_id} queued")
+        cls.start()
+        cls.__wakeup.set()
+
+    @classmethod
+    @contextmanager
+    def hold(cls, file_id: str):
+        """Keep the lease of a task processed inline alive while the block runs."""
+        with cls.__lock:
+            cls.__active.add(file_id)
+        try:
+            yield
+        finally:
+            with cls.__lock:
+                cls.__active.discard(file_id)
+
+    @classmethod
+    def _poll(cls):
+        queue = cls.get_queue()
+        while not cls.__stop.is_set():
+            cls.__wakeup.clear()
+            with cls.__lock:
+                free_slots = settings.task_workers - len(cls.__active)
+
+            if free_slots > 0:
+                session = DatabaseManager.get_session_local()()
+                try:
+                    queue.fail_exhausted(session)
+                    for file_id in queue.claim(session, limit=free_slots):
+                        with cls.__lock:
+                            cls.__active.add(file_id)
+                        cls.get_executor().submit(cls._run, file_id)
+                except Exception as e:
+                    session.rollback()
+                    logger.error(f"Error claiming tasks: {e}")
+                finally:
+                    session.close()
+
+            cls.__wakeup.wait(settings.task_poll_interval)
+
+    @classmethod
+    def _heartbeat(cls):
+        queue = cls.get_queue()
+        interval = settings.task_lease_seconds / 3
+        while not cls.__stop.wait(interval):
+            with cls.__lock:
+                file_ids = list(cls.__active)
+            if not file_ids:
+                continue
+
+            session = DatabaseManager.get_session_local()()
+            try:
+                held = queue.heartbeat(session, file_ids)
+                for file_id in set(file_ids) - held:
+                    logger.warning(f"Lease lost for task {file_id}")
+            except Exception as e:
+                session.rollback()
+                logger.error(f"Error renewing task leases: {e}")
+            finally:
+                session.close()
+
+    @classmethod
+    def _run(cls, file_id: str):
+        session = DatabaseManager.get_session_local()()
+        try:
+            run_file_task(file_id, session, cls.get_queue())
+        except Exception as e:
+            logger.error(f"Task {file_id} failed: {e}")
+        finally:
+            session.close()
+            with cls.__lock:
+                cls.__active.discard(file_id)
+            cls.__wakeup.set()
+
+    @classmethod
+    def shutdown(cls, wait: bool = True):
+        """Stop claiming tasks and wait for the running ones to finish."""
+        cls.__stop.set()
+        cls.__wakeup.set()
+        if cls.__executor is not None:
+            cls.__executor.shutdown(wait=wait)
+            cls.__executor = None
+        with cls.__lock:
+            cls.__threads = []
+
+
+if __name__ == "__main__":
+    # Standalone worker, e.g. against a local Postgres with ENVIRONMENT=local
+    TaskScheduler.start()
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        TaskScheduler.shutdown()
@@ -0,0 +1,114 @@
+import base64
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, BinaryIO, Hashable, List, Optional, Sequence, Tuple
+
+
+def encode_cursor(values: List[Any]) -> str:
+    """
+    Encode the sort key of the last returned row as an opaque pagination cursor.
+
+    Args:
+        values (list): Sort key values, datetimes are allowed.
+
+    Returns:
+        str: URL-safe cursor token.
+    """
+    payload = [
+        {"dt": value.isoformat()} if isinstance(value, datetime) else value
+        for value in values
+    ]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str, types: Optional[Sequence[type]] = None) -> List[Any]:
+    """
+    Decode a cursor created by `encode_cursor`.
+
+    Args:
+        cursor (str): Cursor token.
+        types (sequence, optional): Expected type of each sort key value.
+
+    Returns:
+        list: Sort key values.
+
+    Raises:
+        ValueError: If the token is not a valid cursor, or its values do not
+            match `types`.
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        values = [
+            datetime.fromisoformat(value["dt"]) if isinstance(value, dict) else value
+            for value in payload
+        ]
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+    if types is not None and not (
+        isinstance(payload, list)
+        and len(values) == len(types)
+        # bool is an int subclass but never a valid sort key
+        and all(isinstance(value, t) and not isinstance(value, bool) for value, t in zip(values, types))
+    ):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return values
+
+
+def file_sha256(file_obj: BinaryIO, chunk_size: int = 1024 * 1024) -> str:
+    """
+    Compute the SHA-256 hex digest of a seekable binary file, reading it in chunks.
+
+    The file is left positioned at its start.
+    """
+    hasher = hashlib.sha256()
+    file_obj.seek(0)
+    for chunk in iter(lambda: file_obj.read(chunk_size), b""):
+        hasher.update(chunk)
+    file_obj.seek(0)
+    return hasher.hexdigest()
+
+
+class TTLCache:
+    """
+    Thread-safe mapping whose entries expire `ttl` seconds after being set.
+
+    When `maxsize` is reached the oldest entry is evicted.
+    """
+
+    def __init__(self, ttl: float, maxsize: int = 10000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.pop(key, None)
+            return default if item is None else item[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()